@@ -1,40 +1,51 @@
 import os
+import sys
+from array import array
 SYMBOL_TABLE_RX = {f'R{i}': i for i in range(16)}
 SYMBOL_TABLE = {'SCREEN': 16384, 'KBD': 24576, 'SP': 0, 'LCL': 1, 'ARG': 2, 'THIS': 3, 'THAT': 4}
 SYMBOL_TABLE.update(SYMBOL_TABLE_RX)
+# 所有编码表都是已经移到对应位置的整数，一条 C 指令 = C_INSTRUCTION | comp | dest | jump
+C_INSTRUCTION = 0b111 << 13
+A_ADDRESS_MASK = 0x7FFF
+ROM_SIZE = 32768
+HACK_LINE_BYTES = 17  # '0101010101010101\n'
 JUMP_TABLE = {
-    'JGT': '001', 'JEQ': '010', 'JGE': '011',
-    'JLT': '100', 'JNE': '101', 'JLE': '110',
-    'JMP': '111'
-}
-DEST_TABLE = {
-    'M': '001', 'D': '010', 'MD': '011',
-    'A': '100', 'AM': '101', 'AD': '110',
-    'AMD': '111'
+    'JGT': 0b001, 'JEQ': 0b010, 'JGE': 0b011,
+    'JLT': 0b100, 'JNE': 0b101, 'JLE': 0b110,
+    'JMP': 0b111
 }
+DEST_TABLE = {dest: val << 3 for dest, val in {
+    'M': 0b001, 'D': 0b010, 'MD': 0b011,
+    'A': 0b100, 'AM': 0b101, 'AD': 0b110,
+    'AMD': 0b111
+}.items()}
 COMP_TABLE_A = {
-    '0': '101010',
-    '1': '111111',
-    '-1': '111010',
-    'D': '001100',
-    'A': '110000',
-    '!D': '001101',
-    '!A': '110001',
-    '-D': '001111',
-    '-A': '110011',
-    'D+1': '011111',
-    'A+1': '110111',
-    'D-1': '001110',
-    'A-1': '110010',
-    'D+A': '000010',
-    'D-A': '010011',
-    'A-D': '000111',
-    'D&A': '000000',
-    'D|A': '010101',
+    '0': 0b101010,
+    '1': 0b111111,
+    '-1': 0b111010,
+    'D': 0b001100,
+    'A': 0b110000,
+    '!D': 0b001101,
+    '!A': 0b110001,
+    '-D': 0b001111,
+    '-A': 0b110011,
+    'D+1': 0b011111,
+    'A+1': 0b110111,
+    'D-1': 0b001110,
+    'A-1': 0b110010,
+    'D+A': 0b000010,
+    'D-A': 0b010011,
+    'A-D': 0b000111,
+    'D&A': 0b000000,
+    'D|A': 0b010101,
 }
-COMP_TABLE_M = {comp.replace('A', 'M'): '1' + val for comp, val in COMP_TABLE_A.items() if 'A' in comp}
-COMP_TABLE = {comp: '0' + val for comp, val in COMP_TABLE_A.items()}
+COMP_TABLE_M = {comp.replace('A', 'M'): (0b1000000 | val) << 6 for comp, val in COMP_TABLE_A.items() if 'A' in comp}
+COMP_TABLE = {comp: val << 6 for comp, val in COMP_TABLE_A.items()}
 COMP_TABLE.update(COMP_TABLE_M)
+COMP_TABLE.update({  # 可交换运算的另一种写法，例如 VMtranslator 生成的 A=M+D
+    f'{comp[2]}{comp[1]}{comp[0]}': val for comp, val in COMP_TABLE.items()
+    if len(comp) == 3 and comp[1] in '+&|'
+})
 
 
 class Assembler:
@@ -56,8 +67,11 @@ class Assembler:
         self.symbol_table = SYMBOL_TABLE.copy()
         print(f'LOAD {asm_path} COMPELTED!')
 
+    def _clean(self, code):
+        return ''.join(code.split('//')[0].split())  # 指令内部允许空格，如 D; JLT
+
     def ignore_white_space(self):
-        self.asm = [code.split('//')[0].strip() for code in self.asm]
+        self.asm = [self._clean(code) for code in self.asm]
         self.asm = [code for code in self.asm if len(code) > 0]
 
     def extract_label(self):
@@ -72,11 +86,13 @@ class Assembler:
                     self.symbol_table[label] = cnt
                 labels = []
                 cnt += 1
+        for label in labels:  # 文件末尾的 label 指向程序结束后的位置
+            self.symbol_table[label] = cnt
         self.asm = [code for code in self.asm if not code.startswith('(')]
 
     def instruction_to_binary(self):
         var_cnt = 16
-        hack = []
+        hack = array('H')
         for code in self.asm:
             if code.startswith('@'):
                 instruction = code[1:]
@@ -87,34 +103,136 @@ class Assembler:
                         self.symbol_table[instruction] = var_cnt
                         var_cnt += 1
                     instruction = self.symbol_table[instruction]
-                code_binary = bin(instruction)[2:]  # int to binary
-                if len(code_binary) <= 15:
-                    code_binary = '0' * (15 - len(code_binary)) + code_binary
-                else:
-                    code_binary = code_binary[-15:]
-                code_binary = '0' + code_binary
+                code_binary = instruction & A_ADDRESS_MASK
             else:
-                instruction = code.split(';')
-                jump_binary = self.jump_table[instruction[1]] if len(instruction) > 1 else '000'
-                instruction = instruction[0].split('=')
-                dest_binary = self.dest_table[instruction[0]] if len(instruction) > 1 else '000'
-                comp_binary = self.comp_table[instruction[-1]]
-                code_binary = '111' + comp_binary + dest_binary + jump_binary
+                code_binary = self._c_instruction_to_binary(code)
             hack.append(code_binary)
         self.hack = hack
 
+    def _c_instruction_to_binary(self, code):
+        instruction = code.split(';')
+        jump_binary = self.jump_table[instruction[1]] if len(instruction) > 1 else 0
+        instruction = instruction[0].split('=')
+        dest_binary = self.dest_table[instruction[0]] if len(instruction) > 1 else 0
+        comp_binary = self.comp_table[instruction[-1]]
+        return C_INSTRUCTION | comp_binary | dest_binary | jump_binary
+
     def save_hack(self, custom_path=None):
         hack_path = self.hack_path if custom_path is None else custom_path
         with open(hack_path, 'w', encoding='utf8') as fp:
-            for code in self.hack:
-                fp.write(code+'\n')
+            fp.write(''.join([f'{code:016b}\n' for code in self.hack]))
         print(f'SAVE .hack file in {hack_path}!')
 
-    def asm_compile(self):
+    def save_bin(self, custom_path=None, byteorder='little'):
+        # 每条指令 2 字节的 uint16 镜像，体积约为 .hack 文本的 1/8
+        bin_path = os.path.splitext(self.hack_path)[0] + '.bin' if custom_path is None else custom_path
+        words = array('H', self.hack)
+        if byteorder != sys.byteorder:
+            words.byteswap()
+        with open(bin_path, 'wb') as fp:
+            words.tofile(fp)
+        print(f'SAVE .bin file in {bin_path}!')
+
+    def asm_compile(self, packed=False):
         self.ignore_white_space()
         self.extract_label()
         self.instruction_to_binary()
         self.save_hack()
+        if packed:
+            self.save_bin()
+
+    def _encode_lines(self, asm_lines, emit):
+        '''
+        单遍编码 asm_lines，每条指令编码后立即交给 emit(word)
+        尚未定义的符号先输出占位字，占位字中保存同一符号上一次引用的位置（+1，0 表示链尾）
+        返回 {symbol: 最近一次引用的位置 + 1}，按符号首次出现的顺序排列，供 _backpatch_chains 回填
+        '''
+        self.symbol_table = SYMBOL_TABLE.copy()
+        forward_refs = {}
+        cnt = 0
+        for code in asm_lines:
+            code = self._clean(code)
+            if len(code) == 0:
+                continue
+            if code.startswith('('):
+                self.symbol_table[code[1:-1]] = cnt
+                continue
+            if code.startswith('@'):
+                instruction = code[1:]
+                try:
+                    word = int(instruction) & A_ADDRESS_MASK
+                except ValueError:
+                    if instruction in self.symbol_table:
+                        word = self.symbol_table[instruction] & A_ADDRESS_MASK
+                    else:  # forward reference: label 或变量，先输出链表指针
+                        word = forward_refs.get(instruction, 0)
+                        forward_refs[instruction] = cnt + 1
+            else:
+                word = self._c_instruction_to_binary(code)
+            emit(word)
+            cnt += 1
+            assert cnt <= ROM_SIZE, 'ROM Overflow'
+        return forward_refs
+
+    def _backpatch_chains(self, forward_refs):
+        # 符号在文件结束时仍不是 label 则按首次出现顺序从 16 开始分配变量，与 instruction_to_binary 一致
+        var_cnt = 16
+        for symbol, ref in forward_refs.items():
+            if symbol not in self.symbol_table:  # extract variables
+                self.symbol_table[symbol] = var_cnt
+                var_cnt += 1
+            yield self.symbol_table[symbol] & A_ADDRESS_MASK, ref
+
+    def assemble(self, asm_lines):
+        '''
+        纯内存汇编，不读写文件也不打印，返回 (array('H') 指令, 符号表)
+        asm_lines 为任意可迭代的源码行
+        '''
+        hack = array('H')
+        forward_refs = self._encode_lines(asm_lines, hack.append)
+        for word, ref in self._backpatch_chains(forward_refs):
+            while ref:
+                previous = hack[ref - 1]
+                hack[ref - 1] = word
+                ref = previous
+        self.hack = hack
+        return hack, self.symbol_table
+
+    def stream_compile(self, asm_source, hack_path=None, packed=False, byteorder='little'):
+        '''
+        单遍流式汇编: 逐行读取 .asm（文件路径或任意字符串迭代器），边编码边写出 .hack 或 .bin
+        文件结束后沿占位字中的引用链回填，因此内存占用只与符号数量有关，与程序长度无关
+        .bin 的字节序由 byteorder 指定，与 save_bin 相同
+        '''
+        if isinstance(asm_source, str):
+            head, tail = os.path.split(asm_source)
+            fname, ext = os.path.splitext(tail)
+            if hack_path is None:
+                hack_path = os.path.join(head, fname + ('.bin' if packed else '.hack'))
+            with open(asm_source, 'r', encoding='utf8') as fpr:
+                return self.stream_compile(fpr, hack_path, packed, byteorder)
+        assert hack_path is not None, 'hack_path is required for iterator input'
+
+        self.hack_path = hack_path
+        self.hack = None
+        word_bytes = 2 if packed else HACK_LINE_BYTES
+
+        def encode(word):
+            return word.to_bytes(2, byteorder) if packed else f'{word:016b}\n'.encode('ascii')
+
+        with open(hack_path, 'w+b') as fp:
+            forward_refs = self._encode_lines(asm_source, lambda word: fp.write(encode(word)))
+            cnt = fp.tell() // word_bytes
+            for word, ref in self._backpatch_chains(forward_refs):
+                word = encode(word)
+                while ref:
+                    fp.seek((ref - 1) * word_bytes)
+                    previous = fp.read(word_bytes)
+                    ref = int.from_bytes(previous, byteorder) if packed else int(previous, 2)
+                    fp.seek(-word_bytes, os.SEEK_CUR)
+                    fp.write(word)
+        print(f'SAVE {".bin" if packed else ".hack"} file in {hack_path}!')
+        return cnt
 
 
 if __name__ == '__main__':
@@ -0,0 +1,334 @@
+import sys
+from array import array
+
+from assembler import SYMBOL_TABLE, COMP_TABLE
+
+ROM_SIZE = 32768
+PC_MASK = ROM_SIZE - 1
+RAM_SIZE = 32768
+SCREEN = SYMBOL_TABLE['SCREEN']
+KBD = SYMBOL_TABLE['KBD']
+WORD_MASK = 0xFFFF
+SIGN_BIT = 0x8000
+
+# dest 位: 100 -> A, 010 -> D, 001 -> M
+DEST_A = 4
+DEST_D = 2
+DEST_M = 1
+# jump 位: 100 -> out < 0, 010 -> out == 0, 001 -> out > 0
+JUMP_LT = 4
+JUMP_EQ = 2
+JUMP_GT = 1
+JUMP_ALWAYS = 7
+
+
+def _alu(x, y, zx, nx, zy, ny, f, no):
+    # 按照 ALU 的六个控制位逐步计算，用于汇编器不会生成的非标准 comp 编码
+    x = 0 if zx else x
+    x = x ^ WORD_MASK if nx else x
+    y = 0 if zy else y
+    y = y ^ WORD_MASK if ny else y
+    out = (x + y) & WORD_MASK if f else x & y
+    return out ^ WORD_MASK if no else out
+
+
+def _comp_expression(comp):
+    # 'D+M' -> '(d + ram[a])'，所有寄存器值都以 16 位无符号整数保存
+    expression = comp.replace('M', 'ram[a]').replace('D', 'd').replace('!', '~')
+    if 'ram' not in expression:
+        expression = expression.replace('A', 'a')
+    return f'(({expression}) & {WORD_MASK})'
+
+
+def _comp_function(code):
+    # code 为 7 位 a+comp 字段
+    for comp, bits in COMP_TABLE.items():
+        if bits >> 6 == code:
+            return eval(f'lambda d, a, ram: {_comp_expression(comp)}')
+    bits = [(code >> i) & 1 for i in range(5, -1, -1)]
+    if code & 0x40:
+        return lambda d, a, ram: _alu(d, ram[a], *bits)
+    return lambda d, a, ram: _alu(d, a, *bits)
+
+
+def _comp_source(code):
+    # 基本块编译使用的源码模板，{a} 与 {m} 在编译时替换为常量地址或寄存器变量
+    for comp, bits in COMP_TABLE.items():
+        if bits >> 6 == code:
+            expression = comp.replace('M', '{m}').replace('D', 'd').replace('A', '{a}').replace('!', '~')
+            if any(op in comp for op in '+-!'):
+                return f'(({expression}) & {WORD_MASK})'
+            return expression
+    bits = ', '.join(str((code >> i) & 1) for i in range(5, -1, -1))
+    return f'_alu(d, {{m}}, {bits})' if code & 0x40 else f'_alu(d, {{a}}, {bits})'
+
+
+COMP_FUNCTIONS = [_comp_function(code) for code in range(128)]
+COMP_SOURCES = [_comp_source(code) for code in range(128)]
+JUMP_SOURCES = {
+    1: '0 < out < 32768',            # JGT
+    2: 'out == 0',                   # JEQ
+    3: 'out < 32768',                # JGE
+    4: 'out >= 32768',               # JLT
+    5: 'out != 0',                   # JNE
+    6: 'out == 0 or out >= 32768',   # JLE
+}
+
+
+def decode(word):
+    '''
+    A 指令解码为 int，C 指令解码为 (comp_function, dest, jump)
+    '''
+    if not word & SIGN_BIT:
+        return word
+    return COMP_FUNCTIONS[(word >> 6) & 0x7F], (word >> 3) & 7, word & 7
+
+
+class CPUEmulator:
+    def __init__(self, block_mode=True):
+        # 默认按基本块编译执行；block_mode=False 时逐条解释执行，step() 与块预算不足时的余量总是逐条解释
+        self.block_mode = block_mode
+        self.blocks = [None] * ROM_SIZE
+        self.leaders = set()
+        self.rom = array('H', bytes(2 * ROM_SIZE))
+        self.ram = [0] * RAM_SIZE
+        self.code = [decode(0)] * ROM_SIZE
+        self.rom_size = 0
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+
+    def load(self, hack):
+        '''
+        hack 为 Assembler.hack 中已编码的 int 序列，或 .hack 文件中的 '0101...' 字符串列表
+        '''
+        words = [int(word, 2) if isinstance(word, str) else word for word in hack]
+        assert len(words) <= ROM_SIZE, 'ROM Overflow'
+        self.rom = array('H', words + [0] * (ROM_SIZE - len(words)))
+        self.rom_size = len(words)
+        self.code = [decode(word) for word in self.rom]
+        self.blocks = [None] * ROM_SIZE
+        self.leaders = self._find_leaders()
+        self.reset()
+
+    def load_hack(self, hack_path):
+        with open(hack_path, 'r', encoding='utf8') as fp:
+            self.load([line.strip() for line in fp if len(line.strip()) > 0])
+
+    def load_bin(self, bin_path, byteorder='little'):
+        # Assembler.save_bin 输出的 uint16 镜像
+        words = array('H')
+        with open(bin_path, 'rb') as fp:
+            words.frombytes(fp.read())
+        if byteorder != sys.byteorder:
+            words.byteswap()
+        self.load(words)
+
+    def reset(self):
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+
+    def clear_ram(self):
+        self.ram[:] = [0] * RAM_SIZE
+
+    def set_key(self, key_code):
+        self.ram[KBD] = key_code & WORD_MASK
+
+    def peek(self, address):
+        # 以有符号整数读取，方便与 .cmp 中的 %D 输出对照
+        val = self.ram[address]
+        return val - 0x10000 if val & SIGN_BIT else val
+
+    def poke(self, address, val):
+        self.ram[address] = val & WORD_MASK
+
+    def step(self):
+        return self._interpret(1)
+
+    def run(self, max_cycles):
+        '''
+        最多执行 max_cycles 条指令，遇到 (END) @END 0;JMP 形式的死循环时提前停止
+        返回实际执行的指令数
+        '''
+        if self.block_mode:
+            return self._run_blocks(max_cycles)
+        return self._interpret(max_cycles)
+
+    def _interpret(self, max_cycles):
+        code = self.code
+        ram = self.ram
+        a, d, pc = self.a, self.d, self.pc
+        executed = 0
+        halted = False
+        # 循环内用到的常量与类型绑定为局部变量，避免每条指令都查找全局名
+        _int, pc_mask, sign_bit = int, PC_MASK, SIGN_BIT
+        dest_a, dest_d, dest_m = DEST_A, DEST_D, DEST_M
+        jump_lt, jump_eq, jump_gt, jump_always = JUMP_LT, JUMP_EQ, JUMP_GT, JUMP_ALWAYS
+        while executed < max_cycles:
+            executed += 1
+            instruction = code[pc]
+            if instruction.__class__ is _int:  # A-instruction
+                a = instruction
+                pc = (pc + 1) & pc_mask
+                continue
+            comp, dest, jump = instruction
+            out = comp(d, a, ram)
+            target = a
+            if dest:
+                if dest & dest_m:
+                    ram[a] = out
+                if dest & dest_d:
+                    d = out
+                if dest & dest_a:
+                    a = out
+            if jump and (jump == jump_always or (
+                    jump & jump_lt and out & sign_bit or
+                    jump & jump_eq and out == 0 or
+                    jump & jump_gt and 0 < out < sign_bit)):
+                # 只有不写任何寄存器的 @END 0;JMP 才是停机循环，M=M+1;JMP 之类的死循环每次都有副作用
+                if jump == jump_always and not dest and target == pc - 1 and code[target] == target:
+                    pc = target
+                    halted = True
+                    break
+                pc = target & pc_mask
+            else:
+                pc = (pc + 1) & pc_mask
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += executed
+        self.halted = halted
+        return executed
+
+    def _find_leaders(self):
+        # 基本块入口: 0 号指令、跳转指令的下一条、以及 @X 紧跟跳转指令时的 X
+        code = self.code
+        leaders = {0}
+        for pc in range(self.rom_size):
+            instruction = code[pc]
+            if instruction.__class__ is not int and instruction[2]:
+                leaders.add(pc + 1)
+                previous = code[pc - 1] if pc > 0 else None
+                if previous.__class__ is int:
+                    leaders.add(previous)
+        return leaders
+
+    def _compile_block(self, start):
+        '''
+        把从 start 开始的直线代码编译为一个 Python 函数 block(a, d, ram) -> (a, d, pc)
+        块在跳转指令处（包含）或下一个 leader 之前结束
+        编译期已知的 A 值（@X）直接折叠成 ram[X]，只在块出口写回寄存器 a
+        '''
+        code = self.code
+        lines = []
+        a_const = None  # None 表示 A 只能在运行时取得
+        pc = start
+        exit_lines = None
+        while pc < ROM_SIZE:
+            instruction = code[pc]
+            pc += 1
+            if instruction.__class__ is int:
+                a_const = instruction
+            else:
+                _, dest, jump = instruction
+                a_src = 'a' if a_const is None else str(a_const)
+                m_src = f'ram[{a_src}]'
+                expression = COMP_SOURCES[(self.rom[pc - 1] >> 6) & 0x7F].format(a=a_src, m=m_src)
+                targets = []
+                if dest & DEST_M:
+                    targets.append(m_src)
+                if dest & DEST_D:
+                    targets.append('d')
+                if dest & DEST_A:
+                    targets.append('a')
+                if jump:
+                    if jump != JUMP_ALWAYS:
+                        targets.insert(0, 'out')
+                    if a_const is not None:
+                        target_src = str(a_const & PC_MASK)
+                    elif dest & DEST_A:  # 跳转地址取本条指令执行前的 A
+                        lines.append('target = a')
+                        target_src = f'target & {PC_MASK}'
+                    else:
+                        target_src = f'a & {PC_MASK}'
+                if targets:
+                    lines.append(f"{' = '.join(targets)} = {expression}")
+                if dest & DEST_A:
+                    a_const = None
+                if jump:
+                    a_exit = 'a' if a_const is None else str(a_const)
+                    if jump == JUMP_ALWAYS:
+                        exit_lines = [f'return {a_exit}, d, {target_src}']
+                    else:
+                        exit_lines = [
+                            f'if {JUMP_SOURCES[jump]}:',
+                            f'    return {a_exit}, d, {target_src}',
+                            f'return {a_exit}, d, {pc & PC_MASK}',
+                        ]
+                    break
+            if pc in self.leaders:
+                break
+        if exit_lines is None:
+            a_exit = 'a' if a_const is None else str(a_const)
+            exit_lines = [f'return {a_exit}, d, {pc & PC_MASK}']
+        body = '\n'.join('    ' + line for line in lines + exit_lines)
+        source = f'def block(a, d, ram):\n{body}\n'
+        namespace = {'_alu': _alu}
+        exec(compile(source, f'<block {start}>', 'exec'), namespace)
+        length = pc - start
+        # 与 _interpret 相同，只有不写任何寄存器的 @start 0;JMP 才是停机循环
+        halt = (length == 2 and code[start] == start and code[start + 1].__class__ is not int
+                and code[start + 1][1] == 0 and code[start + 1][2] == JUMP_ALWAYS)
+        return namespace['block'], length, halt
+
+    def _run_blocks(self, max_cycles):
+        blocks = self.blocks
+        ram = self.ram
+        a, d, pc = self.a, self.d, self.pc
+        executed = 0
+        halted = False
+        while executed < max_cycles:
+            block = blocks[pc]
+            if block is None:
+                block = blocks[pc] = self._compile_block(pc)
+            function, length, halt = block
+            if executed + length > max_cycles:
+                break
+            if halt:
+                a = pc
+                executed += length
+                halted = True
+                break
+            a, d, pc = function(a, d, ram)
+            executed += length
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += executed
+        if executed < max_cycles and not halted:  # 剩余不足一个块的指令逐条解释执行
+            executed += self._interpret(max_cycles - executed)
+        else:
+            self.halted = halted
+        return executed
+
+
+if __name__ == '__main__':
+    import time
+
+    for block_mode in [False, True]:
+        cpu = CPUEmulator(block_mode)
+        for path, max_cycles in [('./add/Add.hack', 100), ('./max/Max.hack', 100),
+                                 ('./rect/Rect.hack', 10000), ('./pong/Pong.hack', 5000000)]:
+            cpu.load_hack(path)
+            cpu.clear_ram()
+            if path.endswith('Max.hack'):
+                cpu.poke(0, 3)
+                cpu.poke(1, 5)
+            elif path.endswith('Rect.hack'):
+                cpu.poke(0, 4)
+            start = time.perf_counter()
+            cpu.run(max_cycles)
+            elapsed = time.perf_counter() - start
+            print(f'RUN {path} (block_mode={block_mode}): {cpu.cycles} cycles, halted={cpu.halted}, '
+                  f'{cpu.cycles / elapsed / 1e6:.2f}M cycles/s, RAM[0..2]={cpu.ram[:3]}')
@@ -0,0 +1,87 @@
+import os
+import sys
+from array import array
+
+import pytest
+
+from assembler import SYMBOL_TABLE, Assembler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# 向前引用的 label、被多次引用的 label 与变量、同一位置的多个 label 以及文件末尾的 label
+PROGRAM = [
+    '// forward labels and variables',
+    '@i', 'M=1',
+    '@sum', 'M=0',
+    '(LOOP)',
+    '@i', 'D=M  // i',
+    '@100', 'D=D-A',
+    '@END', 'D; JGT',
+    '@i', 'D=M',
+    '@sum', 'M=D+M',
+    '@i', 'M=M+1',
+    '@LOOP', '0;JMP',
+    '(END)', '(HALT)',
+    '@HALT', '0;JMP',
+    '@TAIL', '@END', '@i',
+    '(TAIL)',
+]
+CASES = [('program', PROGRAM), ('pong', os.path.join(HERE, 'pong', 'Pong.asm'))]
+
+
+def _lines(source):
+    if isinstance(source, str):
+        with open(source, 'r', encoding='utf8') as fpr:
+            return fpr.readlines()
+    return source
+
+
+def _two_pass(source):
+    # 原来的两遍汇编: 先收集 label，再分配变量并编码
+    assembler = Assembler()
+    assembler.asm = list(_lines(source))
+    assembler.symbol_table = SYMBOL_TABLE.copy()
+    assembler.ignore_white_space()
+    assembler.extract_label()
+    assembler.instruction_to_binary()
+    return assembler.hack, assembler.symbol_table
+
+
+@pytest.mark.parametrize('name, source', CASES)
+def test_assemble_matches_two_pass(name, source):
+    hack, symbol_table = _two_pass(source)
+    assert Assembler().assemble(_lines(source)) == (hack, symbol_table)
+
+
+@pytest.mark.parametrize('name, source', CASES)
+@pytest.mark.parametrize('packed, byteorder', [(False, 'little'), (True, 'little'), (True, 'big')])
+def test_stream_compile_matches_two_pass(name, source, packed, byteorder, tmp_path):
+    hack, _ = _two_pass(source)
+    hack_path = str(tmp_path / ('out.bin' if packed else 'out.hack'))
+    assert Assembler().stream_compile(iter(_lines(source)), hack_path, packed, byteorder) == len(hack)
+    if packed:
+        words = array('H')
+        with open(hack_path, 'rb') as fpr:
+            words.frombytes(fpr.read())
+        if byteorder != sys.byteorder:
+            words.byteswap()
+        assert words == hack
+    else:
+        with open(hack_path, 'r', encoding='utf8') as fpr:
+            assert fpr.read() == ''.join(f'{code:016b}\n' for code in hack)
+
+
+def test_stream_compile_matches_save_bin(tmp_path):
+    # 文件路径输入时输出写在 .asm 旁边；.bin 与两遍汇编后 save_bin 在相同字节序下逐字节一致
+    asm_path = str(tmp_path / 'Pong.asm')
+    with open(asm_path, 'w', encoding='utf8') as fpw:
+        fpw.writelines(_lines(CASES[1][1]))
+    assembler = Assembler()
+    assembler.hack_path = str(tmp_path / 'Pong.hack')
+    assembler.hack, _ = _two_pass(asm_path)
+    for byteorder in ('little', 'big'):
+        Assembler().stream_compile(asm_path, packed=True, byteorder=byteorder)
+        with open(str(tmp_path / 'Pong.bin'), 'rb') as fpr:
+            streamed = fpr.read()
+        assembler.save_bin(str(tmp_path / 'Classic.bin'), byteorder)
+        with open(str(tmp_path / 'Classic.bin'), 'rb') as fpr:
+            assert fpr.read() == streamed
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from assembler import Assembler
+from emulator import CPUEmulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _run(program, block_mode, max_cycles, inputs=()):
+    cpu = CPUEmulator(block_mode)
+    if isinstance(program, str):
+        cpu.load_hack(os.path.join(HERE, program))
+    else:
+        cpu.load(Assembler().assemble(program)[0])
+    for address, val in inputs:
+        cpu.poke(address, val)
+    cpu.run(max_cycles)
+    return cpu
+
+
+@pytest.mark.parametrize('program, max_cycles, inputs', [
+    # 第二个字是 A 指令的两字基本块
+    (['@0', '@1', '(LOOP)', 'D=M', '@LOOP', 'D;JGT', '(END)', '@END', '0;JMP'], 100, [(1, 3)]),
+    (['@5', 'D=A', '@0', 'M=D', '(LOOP)', '@0', 'MD=M-1', '@LOOP', 'D;JGT', '(END)', '@END', '0;JMP'], 1000, []),
+    # 跳回自身但带 dest 的死循环不是停机
+    (['(L)', '@L', 'M=M+1;JMP'], 101, []),
+    (['@5', 'D=A', '(L)', '@L', 'D=D-1;JMP'], 101, []),
+    ('max/Max.hack', 100, [(0, 3), (1, 5)]),
+    ('rect/Rect.hack', 10000, [(0, 4)]),
+    ('pong/Pong.hack', 200000, []),
+])
+def test_block_mode_matches_interpreter(program, max_cycles, inputs):
+    interpreted = _run(program, False, max_cycles, inputs)
+    blocked = _run(program, True, max_cycles, inputs)
+    assert blocked.ram == interpreted.ram
+    assert (blocked.a, blocked.d, blocked.pc) == (interpreted.a, interpreted.d, interpreted.pc)
+    assert (blocked.cycles, blocked.halted) == (interpreted.cycles, interpreted.halted)
+
+
+@pytest.mark.parametrize('program, ram0, d', [
+    (['(L)', '@L', 'M=M+1;JMP'], 50, 0),
+    (['@5', 'D=A', '(L)', '@L', 'D=D-1;JMP'], 0, (5 - 49) & 0xFFFF),
+    (['(END)', '@END', '0;JMP'], 0, 0),
+])
+def test_jump_to_self_with_dest_is_not_halt(program, ram0, d):
+    # 跳回自身的 C 指令带 dest 时每次循环都有副作用，不能当作停机
+    cpu = _run(program, False, 100)
+    assert cpu.halted == (program[-1] == '0;JMP')
+    assert (cpu.ram[0], cpu.d) == (ram0, d)
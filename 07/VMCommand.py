@@ -0,0 +1,70 @@
+'''
+VM 命令的紧凑 IR，07 / 08 的 VMtranslator 与 08 的 VMEmulator 共用
+每条命令是一个 VMCommand，op 为整数操作码，算术命令各占一个操作码，翻译器按 op 查表分派
+'''
+(
+    C_ADD, C_SUB, C_NEG, C_EQ, C_GT, C_LT, C_AND, C_OR, C_NOT,
+    C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_CALL, C_RETURN,
+    # 只由优化产生: not; if-goto | call; return | call; pop temp 0 | push x; pop y
+    C_IF_NOT, C_TAIL_CALL, C_DISCARD, C_MOVE,
+) = range(21)
+
+OPCODE = {
+    'add': C_ADD,
+    'sub': C_SUB,
+    'neg': C_NEG,
+    'eq': C_EQ,
+    'gt': C_GT,
+    'lt': C_LT,
+    'and': C_AND,
+    'or': C_OR,
+    'not': C_NOT,
+    'push': C_PUSH,
+    'pop': C_POP,
+    'label': C_LABEL,
+    'goto': C_GOTO,
+    'if-goto': C_IF,
+    'function': C_FUNCTION,
+    'return': C_RETURN,
+    'call': C_CALL,
+}
+KEYWORD = {op: keyword for keyword, op in OPCODE.items()}
+KEYWORD[C_IF_NOT] = 'if-not-goto'
+KEYWORD[C_TAIL_CALL] = 'tail-call'
+KEYWORD[C_DISCARD] = 'discard'
+KEYWORD[C_MOVE] = 'move'
+ARITHMETIC = frozenset(range(C_ADD, C_NOT + 1))
+
+
+class VMCommand:
+    __slots__ = ('op', 'arg1', 'arg2')
+
+    def __init__(self, op, arg1=None, arg2=None):
+        self.op = op
+        self.arg1 = arg1  # segment | label | function name | C_MOVE 的 push 命令
+        self.arg2 = arg2  # index | nLocals | nArgs | C_MOVE 的 pop 命令
+
+    def __eq__(self, other):
+        return isinstance(other, VMCommand) and (self.op, self.arg1, self.arg2) == (other.op, other.arg1, other.arg2)
+
+    def __repr__(self):
+        return ' '.join(str(arg) for arg in (KEYWORD[self.op], self.arg1, self.arg2) if arg is not None)
+
+
+def parse_command(vm_code):
+    vm_code_tokens = vm_code.split()
+    return VMCommand(
+        OPCODE[vm_code_tokens[0]],
+        vm_code_tokens[1] if len(vm_code_tokens) > 1 else None,  # C_PUSH, C_POP, C_LABEL, C_IF, C_GOTO,  C_FUNCTION, C_CALL
+        int(vm_code_tokens[2]) if len(vm_code_tokens) > 2 else None,  # C_PUSH, C_POP, C_FUNCTION, C_CALL
+    )
+
+
+def parse_vm(vm_codes):
+    # vm_codes 为任意可迭代的 VM 命令行，去掉注释与空行后解析为 [VMCommand, ...]
+    commands = []
+    for vm_code in vm_codes:
+        vm_code = vm_code.split('//')[0].strip()
+        if len(vm_code) > 0:
+            commands.append(parse_command(vm_code))
+    return commands
@@ -0,0 +1,52 @@
+import hashlib
+import json
+
+
+def source_digest(*paths):
+    # 源码文件内容的 sha1，作为缓存的版本号，修改其中任何一个文件后旧缓存整体作废
+    sha1 = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as fpr:
+            sha1.update(fpr.read())
+    return sha1.hexdigest()
+
+
+class BuildCache:
+    '''
+    目录级的构建缓存，JackCompiler 与 VMtranslator 共用，保存在 cache_path:
+    {'version': 工具版本, 'entries': {文件名: {'hash': key 的结果, 'data': 该文件的产物}}}
+    key(file_name, source) 由各工具给出，决定哪些输入（源码、选项、链接结果）变化后需要重新生成
+    version 与保存时不同的缓存整体作废
+    '''
+    def __init__(self, cache_path, version, key):
+        self.cache_path = cache_path
+        self.version = version
+        self.key = key
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(self.cache_path, 'r', encoding='utf8') as fpr:
+                cache = json.load(fpr)
+            if cache.get('version') == version:
+                self.entries = cache['entries']
+        except (OSError, ValueError, KeyError):  # 没有缓存或缓存损坏时从头生成
+            pass
+
+    def digest(self, file_name, source):
+        return self.key(file_name, source)
+
+    def get(self, file_name, digest):
+        entry = self.entries.get(file_name)
+        if entry is not None and entry['hash'] == digest:
+            return entry['data']
+        return None
+
+    def put(self, file_name, digest, data):
+        self.entries[file_name] = {'hash': digest, 'data': data}
+        self.dirty = True
+
+    def save(self):
+        if self.dirty:
+            with open(self.cache_path, 'w', encoding='utf8') as fpw:
+                json.dump({'version': self.version, 'entries': self.entries}, fpw)
+            self.dirty = False
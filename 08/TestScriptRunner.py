@@ -0,0 +1,393 @@
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '06'))
+from assembler import Assembler  # noqa: E402
+from emulator import CPUEmulator  # noqa: E402
+from VMEmulator import VMEmulator  # noqa: E402
+from VMtranslator import VMtranslator  # noqa: E402
+
+TST_TOKEN = re.compile(r'"[^"]*"|[{},;]|[^\s{},;]+')
+OUTPUT_FORMAT = re.compile(r'(.+)%([BDSX])(\d+)\.(\d+)\.(\d+)$')
+VM_POINTER = {'sp': 0, 'local': 1, 'argument': 2, 'this': 3, 'that': 4}
+
+
+class UnsupportedScript(Exception):
+    pass
+
+
+def _strip_comments(tst_code):
+    tst_code = re.sub(r'/\*.*?\*/', ' ', tst_code, flags=re.S)
+    return re.sub(r'//[^\n]*', ' ', tst_code)
+
+
+def parse_tst(tst_code):
+    '''
+    把 .tst 脚本解析为嵌套的命令列表:
+    ('cmd', [word, ...]) | ('repeat', n, body) | ('while', [cond, ...], body)
+    '''
+    tokens = TST_TOKEN.findall(_strip_comments(tst_code))
+    idx = 0
+
+    def parse_block():
+        nonlocal idx
+        block = []
+        words = []
+        while idx < len(tokens):
+            token = tokens[idx]
+            idx += 1
+            if token in (',', ';'):
+                if words:
+                    block.append(('cmd', words))
+                words = []
+            elif token == '{':
+                body = parse_block()
+                if words[0] == 'repeat':  # repeat 不带次数表示无限循环，n 记为 None
+                    block.append(('repeat', int(words[1]) if len(words) > 1 else None, body))
+                else:  # while
+                    block.append(('while', words[1:], body))
+                words = []
+            elif token == '}':
+                break
+            else:
+                words.append(token)
+        if words:
+            block.append(('cmd', words))
+        return block
+
+    return parse_block()
+
+
+def _parse_value(val):
+    if val.startswith('%B'):
+        return int(val[2:], 2)
+    elif val.startswith('%X'):
+        return int(val[2:], 16)
+    elif val.startswith('%D'):
+        return int(val[2:])
+    return int(val)
+
+
+def _signed(val):
+    val &= 0xFFFF
+    return val - 0x10000 if val & 0x8000 else val
+
+
+def _format_cell(val, fmt, width):
+    if fmt == 'D':
+        return str(_signed(val)) if isinstance(val, int) else str(val)
+    elif fmt == 'B':
+        return format(val & ((1 << width) - 1), f'0{width}b')
+    elif fmt == 'X':
+        return format(val & 0xFFFF, f'0{width}X')
+    return str(val)
+
+
+def _split_row(line):
+    return [cell.strip() for cell in line.strip().strip('|').split('|')]
+
+
+def compare_output(out_lines, cmp_lines):
+    '''
+    与官方 TextComparer 相同，逐行逐列比较输出，表头比较列名，数据行中 .cmp 的 * 为通配符；
+    行数不同（输出多出或缺少行）也是差异
+    返回 None 表示一致，否则返回第一处差异的描述
+    '''
+    out_lines = [line for line in out_lines if line.strip()]
+    cmp_lines = [line for line in cmp_lines if line.strip()]
+    for row, (out_line, cmp_line) in enumerate(zip(out_lines, cmp_lines)):
+        out_cells, cmp_cells = _split_row(out_line), _split_row(cmp_line)
+        if len(out_cells) != len(cmp_cells):
+            return f'line {row + 1}: expected {cmp_line.strip()} got {out_line.strip()}'
+        for out_cell, cmp_cell in zip(out_cells, cmp_cells):
+            if (row == 0 or '*' not in cmp_cell) and out_cell != cmp_cell:
+                return f'line {row + 1}: expected {cmp_line.strip()} got {out_line.strip()}'
+    if len(out_lines) < len(cmp_lines):
+        return f'line {len(out_lines) + 1}: missing output, expected {cmp_lines[len(out_lines)].strip()}'
+    if len(out_lines) > len(cmp_lines):
+        return f'line {len(cmp_lines) + 1}: extra output {out_lines[len(cmp_lines)].strip()}'
+    return None
+
+
+class CPUSimulator:
+    '''
+    CPUEmulator 的 .tst 适配层，支持 RAM[i]、PC、A、D 与 time 变量
+    load Computer.hdl 时同样使用该模拟器，并额外支持 Computer 芯片的引脚名称
+    给出 vm_translator 时，与 .vm 同目录的 .asm 不读取已提交的文件，而是由 vm_translator 重新翻译
+    '''
+    def __init__(self, block_mode=True, vm_translator=None):
+        self.cpu = CPUEmulator(block_mode)
+        self.vm_translator = vm_translator
+        self.time = 0
+        self.half_cycle = False
+        self.reset = 0
+
+    def load(self, path):
+        ext = os.path.splitext(path)[-1]
+        if ext == '.hack':
+            self.cpu.load_hack(path)
+        elif ext == '.asm':
+            asm_codes = None
+            if self.vm_translator is not None:
+                asm_codes = self.vm_translator.translate_project(os.path.dirname(path))
+            if asm_codes is None:
+                with open(path, 'r', encoding='utf8') as fp:
+                    asm_codes = fp.readlines()
+            hack, _ = Assembler().assemble(asm_codes)
+            self.cpu.load(hack)
+
+    def _address(self, name):
+        match = re.match(r'(RAM|RAM16K)\[(\d+)\]$', name)
+        return int(match.group(2)) if match else None
+
+    def get(self, name):
+        address = self._address(name)
+        if address is not None:
+            return self.cpu.ram[address]
+        elif name == 'time':
+            return f'{self.time}+' if self.half_cycle else str(self.time)
+        elif name in ('PC', 'PC[]'):
+            return self.cpu.pc
+        elif name in ('A', 'ARegister[]', 'ARegister[0]'):
+            return self.cpu.a
+        elif name in ('D', 'DRegister[]', 'DRegister[0]'):
+            return self.cpu.d
+        elif name == 'reset':
+            return self.reset
+        raise UnsupportedScript(f'Unknown variable {name}')
+
+    def set(self, name, val):
+        address = self._address(name)
+        if address is not None:
+            self.cpu.poke(address, val)
+        elif name in ('PC', 'PC[]'):
+            self.cpu.pc = val & 0x7FFF
+        elif name in ('A', 'ARegister[]', 'ARegister[0]'):
+            self.cpu.a = val & 0xFFFF
+        elif name in ('D', 'DRegister[]', 'DRegister[0]'):
+            self.cpu.d = val & 0xFFFF
+        elif name == 'reset':
+            self.reset = val
+        else:
+            raise UnsupportedScript(f'Unknown variable {name}')
+
+    def tick(self):
+        self.half_cycle = True
+
+    def tock(self):
+        # 寄存器与 RAM 在 tock 时提交，因此整条指令在 tock 时执行
+        self.cpu.step()
+        if self.reset:
+            self.cpu.pc = 0
+        self.half_cycle = False
+        self.time += 1
+
+    def ticktock(self, n=1):
+        if self.reset:
+            for _ in range(n):
+                self.tick()
+                self.tock()
+        else:
+            self.cpu.run(n)
+            self.time += n
+
+    def command(self, words, base_dir):
+        if words[:2] == ['ROM32K', 'load']:
+            self.load(os.path.join(base_dir, words[2]))
+        else:
+            raise UnsupportedScript(f'Unknown command {" ".join(words)}')
+
+
+class VMSimulator:
+    '''
+    VMEmulator 的 .tst 适配层，支持 RAM[i]、sp、local、argument、this、that 与 segment[i] 变量
+    '''
+    def __init__(self):
+        self.vm = VMEmulator()
+        self.time = 0
+
+    def load(self, path):
+        self.vm.load(path)
+
+    def _address(self, name):
+        match = re.match(r'(\w+)\[(\d+)\]$', name)
+        if match is None:
+            return None
+        segment, index = match.group(1), int(match.group(2))
+        if segment == 'RAM':
+            return index
+        return self.vm._address(segment, index)
+
+    def get(self, name):
+        address = self._address(name)
+        if address is not None:
+            return self.vm.ram[address]
+        elif name in VM_POINTER:
+            return self.vm.ram[VM_POINTER[name]]
+        elif name == 'time':
+            return str(self.time)
+        raise UnsupportedScript(f'Unknown variable {name}')
+
+    def set(self, name, val):
+        address = self._address(name)
+        if address is None:
+            address = VM_POINTER.get(name)
+        if address is None:
+            raise UnsupportedScript(f'Unknown variable {name}')
+        self.vm.poke(address, val)
+
+    def vmstep(self, n=1):
+        self.vm.run(n)
+        self.time += n
+
+    def command(self, words, base_dir):
+        raise UnsupportedScript(f'Unknown command {" ".join(words)}')
+
+
+class TestScriptRunner:
+    '''
+    translate_vm 时 07 / 08 的 CPU 测试运行前都用当前的 VMtranslator(**vm_options) 从 .vm 重新生成汇编，
+    否则直接运行目录中已提交的 .asm
+    '''
+    def __init__(self, write_output=False, translate_vm=True, vm_options=None):
+        self.write_output = write_output
+        self.translate_vm = translate_vm
+        self.vm_options = vm_options or {}
+
+    def _create_simulator(self, words, base_dir):
+        # load 命令决定使用哪一个模拟器
+        target = words[1] if len(words) > 1 else None
+        ext = os.path.splitext(target)[-1] if target else '.vm'
+        if ext in ('.asm', '.hack'):
+            simulator = CPUSimulator(vm_translator=VMtranslator(**self.vm_options) if self.translate_vm else None)
+            simulator.load(os.path.join(base_dir, target))
+        elif target == 'Computer.hdl':
+            simulator = CPUSimulator()
+        elif ext == '.vm':
+            simulator = VMSimulator()
+            simulator.load(os.path.join(base_dir, target) if target else base_dir)
+        else:
+            raise UnsupportedScript(f'Cannot simulate {target}')
+        return simulator
+
+    def _output(self, simulator, output_list, out_lines):
+        cells = []
+        for name, fmt, pad_left, width, pad_right in output_list:
+            cell = _format_cell(simulator.get(name), fmt, width)
+            cell = cell.ljust(width) if fmt == 'S' else cell.rjust(width)
+            cells.append(' ' * pad_left + cell + ' ' * pad_right)
+        out_lines.append('|' + '|'.join(cells) + '|')
+
+    def _execute(self, block, state):
+        for item in block:
+            if item[0] == 'repeat':
+                _, n, body = item
+                if n is None:
+                    raise UnsupportedScript('Interactive script (repeat forever)')
+                if len(body) == 1 and body[0] == ('cmd', ['ticktock']):
+                    state['simulator'].ticktock(n)
+                elif len(body) == 1 and body[0] == ('cmd', ['vmstep']):
+                    state['simulator'].vmstep(n)
+                else:
+                    for _ in range(n):
+                        self._execute(body, state)
+            elif item[0] == 'while':
+                raise UnsupportedScript('while')
+            else:
+                self._command(item[1], state)
+
+    def _command(self, words, state):
+        simulator = state['simulator']
+        name = words[0]
+        if name == 'load':
+            state['simulator'] = self._create_simulator(words, state['base_dir'])
+        elif name == 'output-file':
+            state['out_path'] = os.path.join(state['base_dir'], words[1])
+        elif name == 'compare-to':
+            state['cmp_path'] = os.path.join(state['base_dir'], words[1])
+        elif name == 'output-list':
+            output_list = []
+            for word in words[1:]:
+                var_name, fmt, pad_left, width, pad_right = OUTPUT_FORMAT.match(word).groups()
+                output_list.append((var_name, fmt, int(pad_left), int(width), int(pad_right)))
+            state['output_list'] = output_list
+            header = []
+            for var_name, fmt, pad_left, width, pad_right in output_list:
+                total = pad_left + width + pad_right
+                header.append(var_name[:total].center(total))
+            state['out_lines'].append('|' + '|'.join(header) + '|')
+        elif name == 'output':
+            self._output(simulator, state['output_list'], state['out_lines'])
+        elif name == 'set':
+            simulator.set(words[1], _parse_value(words[2]))
+        elif name == 'ticktock':
+            simulator.ticktock()
+        elif name == 'tick':
+            simulator.tick()
+        elif name == 'tock':
+            simulator.tock()
+        elif name == 'vmstep':
+            simulator.vmstep()
+        elif name in ('echo', 'clear-echo'):
+            pass
+        else:
+            simulator.command(words, state['base_dir'])
+
+    def run_file(self, tst_path):
+        '''
+        执行一个 .tst 脚本并与 compare-to 指定的 .cmp 比较
+        返回 (tst_path, status, message)，status 为 PASS | FAIL | SKIP | ERROR
+        '''
+        base_dir = os.path.dirname(tst_path)
+        state = {
+            'base_dir': base_dir, 'simulator': None, 'out_path': None, 'cmp_path': None,
+            'output_list': [], 'out_lines': [],
+        }
+        try:
+            with open(tst_path, 'r', encoding='utf8') as fpr:
+                self._execute(parse_tst(fpr.read()), state)
+        except UnsupportedScript as e:
+            return tst_path, 'SKIP', str(e)
+        except Exception as e:
+            return tst_path, 'ERROR', f'{type(e).__name__}: {e}'
+
+        if self.write_output and state['out_path'] is not None:
+            with open(state['out_path'], 'w', encoding='utf8') as fpw:
+                fpw.writelines([line + '\n' for line in state['out_lines']])
+        if state['cmp_path'] is None:
+            return tst_path, 'PASS', 'no compare-to file'
+        with open(state['cmp_path'], 'r', encoding='utf8') as fpr:
+            diff = compare_output(state['out_lines'], fpr.readlines())
+        return tst_path, 'PASS' if diff is None else 'FAIL', diff or ''
+
+    def run_all(self, tst_paths, jobs=None):
+        '''
+        jobs 为进程数，None 表示使用全部 CPU，1 表示在当前进程内顺序执行
+        结果顺序与 tst_paths 一致
+        '''
+        if jobs == 1:
+            return [self.run_file(tst_path) for tst_path in tst_paths]
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(self.run_file, tst_paths))
+
+
+def discover(*roots):
+    tst_paths = []
+    for root in roots:
+        for head, _, files in os.walk(root):
+            tst_paths += [os.path.join(head, f) for f in files if f.endswith('.tst')]
+    return sorted(tst_paths)
+
+
+if __name__ == '__main__':
+    import time
+
+    start = time.perf_counter()
+    results = TestScriptRunner().run_all(discover('../04', '../05', '../07', './'))
+    for tst_path, status, message in results:
+        print(f'{status:5} {tst_path} {message}')
+    summary = {status: sum(1 for result in results if result[1] == status)
+               for status in ('PASS', 'FAIL', 'SKIP', 'ERROR')}
+    print(f'{summary} in {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,199 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '07'))
+from VMCommand import (  # noqa: E402
+    C_ADD, C_SUB, C_NEG, C_EQ, C_GT, C_LT, C_AND, C_OR, C_NOT,
+    C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_CALL, C_RETURN,
+    parse_vm,
+)
+
+RAM_SIZE = 32768
+WORD_MASK = 0xFFFF
+SIGN_BIT = 0x8000
+SEGMENT_POINTER = {
+    'local': 1,
+    'argument': 2,
+    'this': 3,
+    'that': 4,
+}
+SEGMENT_BASE = {
+    'pointer': 3,
+    'temp': 5,
+}
+BI_OPS = {
+    C_ADD: lambda x, y: (x + y) & WORD_MASK,
+    C_SUB: lambda x, y: (x - y) & WORD_MASK,
+    C_AND: lambda x, y: x & y,
+    C_OR: lambda x, y: x | y,
+    C_EQ: lambda x, y: WORD_MASK if x == y else 0,
+    C_GT: lambda x, y: WORD_MASK if (x ^ SIGN_BIT) > (y ^ SIGN_BIT) else 0,  # 有符号比较
+    C_LT: lambda x, y: WORD_MASK if (x ^ SIGN_BIT) < (y ^ SIGN_BIT) else 0,
+}
+U_OPS = {
+    C_NEG: lambda y: -y & WORD_MASK,
+    C_NOT: lambda y: y ^ WORD_MASK,
+}
+
+
+class VMEmulator:
+    '''
+    直接解释执行 .vm 命令，RAM 布局与 VMtranslator 生成的 Hack 代码保持一致:
+    SP/LCL/ARG/THIS/THAT 位于 RAM[0..4]，temp 位于 RAM[5..12]，static 从 RAM[16] 开始按出现顺序分配
+    返回地址以 VM 命令下标的形式压栈
+    '''
+    def __init__(self):
+        self.ram = [0] * RAM_SIZE
+        self.commands = []
+        self.functions = {}
+        self.pc = 0
+        self.steps = 0
+        self.halted = False
+
+    def _parse_file(self, vm_path):
+        head, tail = os.path.split(vm_path)
+        file_name, ext = os.path.splitext(tail)
+        with open(vm_path, 'r', encoding='utf8') as fpr:
+            return [(command.op, command.arg1, command.arg2, file_name) for command in parse_vm(fpr)]
+
+    def load(self, vm_path):
+        '''
+        vm_path 为单个 .vm 文件或包含多个 .vm 文件的目录
+        '''
+        if os.path.splitext(vm_path)[-1] == '.vm':
+            vm_files = [vm_path]
+        else:
+            vm_files = sorted(os.path.join(vm_path, f) for f in os.listdir(vm_path) if f.endswith('.vm'))
+        commands = []
+        for f in vm_files:
+            commands += self._parse_file(f)
+        self._link(commands)
+        self.reset()
+
+    def _link(self, commands):
+        # 预先解析 label、function 与 static 地址，执行时不再做字符串查找
+        # label 不占用 vmstep，直接指向其后的第一条命令
+        labels = {}
+        self.functions = {}
+        function_name = None
+        idx = 0
+        for op, arg1, arg2, file_name in commands:
+            if op == C_LABEL:
+                labels[(function_name, arg1)] = idx
+                continue
+            if op == C_FUNCTION:
+                function_name = arg1
+                self.functions[arg1] = idx
+            idx += 1
+        static_table = {}
+        self.commands = []
+        function_name = None
+        for op, arg1, arg2, file_name in commands:
+            if op == C_LABEL:
+                continue
+            if op == C_FUNCTION:
+                function_name = arg1
+            if op in (C_GOTO, C_IF):
+                assert (function_name, arg1) in labels, f'Unknown label {arg1} in {function_name}'
+                arg2 = labels[(function_name, arg1)]
+            elif op in (C_PUSH, C_POP) and arg1 == 'static':
+                static_name = f'{file_name}.{arg2}'
+                if static_name not in static_table:
+                    static_table[static_name] = 16 + len(static_table)
+                arg2 = static_table[static_name]
+            self.commands.append((op, arg1, arg2))
+
+    def reset(self):
+        self.pc = self.functions.get('Sys.init', 0)
+        self.steps = 0
+        self.halted = False
+
+    def peek(self, address):
+        val = self.ram[address]
+        return val - 0x10000 if val & SIGN_BIT else val
+
+    def poke(self, address, val):
+        self.ram[address] = val & WORD_MASK
+
+    def _address(self, segment, index):
+        if segment in SEGMENT_POINTER:
+            return self.ram[SEGMENT_POINTER[segment]] + index
+        elif segment in SEGMENT_BASE:
+            return SEGMENT_BASE[segment] + index
+        else:  # static 已在 _link 中解析为绝对地址
+            return index
+
+    def _push(self, val):
+        ram = self.ram
+        ram[ram[0]] = val
+        ram[0] += 1
+
+    def _pop(self):
+        ram = self.ram
+        ram[0] -= 1
+        return ram[ram[0]]
+
+    def step(self):
+        return self.run(1)
+
+    def run(self, max_steps):
+        commands = self.commands
+        ram = self.ram
+        executed = 0
+        while executed < max_steps:
+            if not 0 <= self.pc < len(commands):
+                self.halted = True
+                break
+            op, arg1, arg2 = commands[self.pc]
+            self.pc += 1
+            executed += 1
+            if op in U_OPS:
+                self._push(U_OPS[op](self._pop()))
+            elif op in BI_OPS:
+                y = self._pop()
+                self._push(BI_OPS[op](self._pop(), y))
+            elif op == C_PUSH:
+                if arg1 == 'constant':
+                    self._push(arg2 & WORD_MASK)
+                else:
+                    self._push(ram[self._address(arg1, arg2)])
+            elif op == C_POP:
+                address = self._address(arg1, arg2)
+                ram[address] = self._pop()
+            elif op == C_GOTO:
+                if arg2 == self.pc - 1:  # goto 自身，程序停机
+                    self.halted = True
+                    break
+                self.pc = arg2
+            elif op == C_IF:
+                if self._pop():
+                    self.pc = arg2
+            elif op == C_FUNCTION:
+                for i in range(arg2):
+                    self._push(0)
+            elif op == C_CALL:
+                assert arg1 in self.functions, f'Unknown function {arg1}'
+                self._push(self.pc)
+                for pointer in (1, 2, 3, 4):  # LCL, ARG, THIS, THAT
+                    self._push(ram[pointer])
+                ram[2] = ram[0] - 5 - arg2
+                ram[1] = ram[0]
+                self.pc = self.functions[arg1]
+            elif op == C_RETURN:
+                end_frame = ram[1]
+                ret_addr = ram[end_frame - 5]
+                ram[ram[2]] = self._pop()
+                ram[0] = ram[2] + 1
+                for offset, pointer in enumerate((4, 3, 2, 1), 1):  # THAT, THIS, ARG, LCL
+                    ram[pointer] = ram[end_frame - offset]
+                self.pc = ret_addr
+        self.steps += executed
+        return executed
+
+
+if __name__ == '__main__':
+    vm_emulator = VMEmulator()
+    vm_emulator.load('./FunctionCalls/FibonacciElement')
+    vm_emulator.poke(0, 261)
+    vm_emulator.run(1000)
+    print(f'FibonacciElement: RAM[0]={vm_emulator.peek(0)} RAM[261]={vm_emulator.peek(261)}')
@@ -0,0 +1,183 @@
+'''
+整程序的 VM 命令变换，输入输出都是 [(file_name, [VMCommand, ...]), ...]:
+link_statics 统一分配 static 地址，prune_functions 删除不可达函数，inline_functions 内联小的叶子函数
+VMtranslator 在翻译各个文件之前调用，结果记录在 VMtranslator 的 statics / pruned / inlined 中
+'''
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '07'))
+from VMCommand import (  # noqa: E402
+    C_NEG, C_NOT, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_CALL, C_RETURN, VMCommand,
+)
+
+STATIC_BASE = 16  # static 区 RAM[16..255]
+STATIC_END = 256
+INLINE_FRAME = '$INLINE'  # 内联展开的参数、局部变量与保存的 THIS / THAT 放在 static 区的 $INLINE.k 中
+INLINE_BARRIER = frozenset([C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_CALL])  # 只内联没有分支与调用的叶子函数
+
+
+def static_name(file_name, index):
+    # static 的全局名 File.i；内联展开后的命令中 index 已经是带文件名的全局名
+    return index if isinstance(index, str) else f'{file_name}.{index}'
+
+
+def file_statics(file_name, commands):
+    for command in commands:
+        if command.op in (C_PUSH, C_POP) and command.arg1 == 'static':
+            yield static_name(file_name, command.arg2)
+
+
+def link_statics(vm_commands):
+    '''
+    为 vm_commands 中所有文件的 static 变量按文件顺序与首次出现的顺序统一分配 RAM[16..255] 中的地址，
+    返回 {static_name: address}；超出 static 区时报错
+    '''
+    statics = {}
+    for file_name, commands in vm_commands:
+        for name in file_statics(file_name, commands):
+            if name not in statics:
+                statics[name] = STATIC_BASE + len(statics)
+    assert STATIC_BASE + len(statics) <= STATIC_END, \
+        f'Static Overflow: {len(statics)} statics, only {STATIC_END - STATIC_BASE} words in RAM[{STATIC_BASE}..{STATIC_END - 1}]'
+    return statics
+
+
+def static_report(statics):
+    return f'{len(statics)} / {STATIC_END - STATIC_BASE} static words used'
+
+
+def prune_functions(vm_files, entry='Sys.init'):
+    '''
+    按 function 切分后沿 call 建立调用图，只保留从 entry 可达的函数，第一个 function 之前的命令总是保留；
+    没有 entry 时原样返回。返回 (剪枝后的 vm_files, 按出现顺序排列的被删除函数名)
+    '''
+    calls = {None: []}  # function_name -> 调用的函数，None 表示第一个 function 之前的命令
+    files_blocks = []
+    for file_name, commands in vm_files:
+        blocks = [(None, [])]
+        for command in commands:
+            if command.op == C_FUNCTION:
+                blocks.append((command.arg1, []))
+                calls[command.arg1] = []
+            elif command.op == C_CALL:
+                calls[blocks[-1][0]].append(command.arg1)
+            blocks[-1][1].append(command)
+        files_blocks.append((file_name, blocks))
+    if entry not in calls:
+        return vm_files, []
+
+    reachable = {None, entry}
+    stack = [None, entry]
+    while stack:
+        for callee in calls[stack.pop()]:
+            if callee in calls and callee not in reachable:
+                reachable.add(callee)
+                stack.append(callee)
+    pruned = [function_name for function_name in calls if function_name not in reachable]
+    return [
+        (file_name, [command for function_name, block in blocks if function_name in reachable for command in block])
+        for file_name, blocks in files_blocks
+    ], pruned
+
+
+def _inline_cost(n_args, n_locals, body):
+    # 每个调用点展开后增加的 VM 命令数: 弹出参数、保存与恢复 THIS / THAT、局部变量清零以及去掉 return 的函数体
+    saved = {command.arg2 for command in body if command.op == C_POP and command.arg1 == 'pointer'}
+    return n_args + 4 * len(saved) + 2 * n_locals + len(body) - 1
+
+
+def _returns_one_value(body):
+    '''
+    模拟函数体的栈深度: 从空栈开始，任何命令都不能取到栈底以下，return 之前恰好剩下返回值一个字
+    return 只取栈顶，多余的值随栈帧一起丢弃；展开后没有栈帧，不满足该条件的函数会破坏调用者的栈
+    '''
+    depth = 0
+    for command in body[:-1]:  # 叶子函数体中只有 push / pop / 算术命令
+        if command.op == C_PUSH:
+            depth += 1
+        elif command.op in (C_NEG, C_NOT):  # 一元运算弹出一个压入一个
+            if depth < 1:
+                return False
+        else:  # pop 弹出一个，二元运算弹出两个压入一个
+            if depth < (1 if command.op == C_POP else 2):
+                return False
+            depth -= 1
+    return depth == 1
+
+
+def _expand_inline(file_name, n_args, n_locals, body):
+    '''
+    call f n_args 的展开: 栈顶的参数弹出到 $INLINE.0 ~ n_args - 1，局部变量紧随其后，
+    被改写的 pointer 先保存再在末尾恢复；函数体去掉 return 后，返回值正好留在原先第一个参数的位置
+    '''
+    def slot(k):
+        return f'{INLINE_FRAME}.{k}'
+
+    saved = sorted({command.arg2 for command in body if command.op == C_POP and command.arg1 == 'pointer'})
+    saved_slot = {pointer: n_args + n_locals + i for i, pointer in enumerate(saved)}
+    expanded = [VMCommand(C_POP, 'static', slot(i)) for i in reversed(range(n_args))]
+    for pointer in saved:
+        expanded += [VMCommand(C_PUSH, 'pointer', pointer), VMCommand(C_POP, 'static', slot(saved_slot[pointer]))]
+    for j in range(n_locals):
+        expanded += [VMCommand(C_PUSH, 'constant', 0), VMCommand(C_POP, 'static', slot(n_args + j))]
+    for command in body[:-1]:
+        if command.arg1 == 'argument':
+            command = VMCommand(command.op, 'static', slot(command.arg2))
+        elif command.arg1 == 'local':
+            command = VMCommand(command.op, 'static', slot(n_args + command.arg2))
+        elif command.arg1 == 'static':
+            command = VMCommand(command.op, 'static', static_name(file_name, command.arg2))
+        expanded.append(command)
+    for pointer in saved:
+        expanded += [VMCommand(C_PUSH, 'static', slot(saved_slot[pointer])), VMCommand(C_POP, 'pointer', pointer)]
+    return expanded
+
+
+def inline_functions(vm_commands, max_cost):
+    '''
+    函数体中没有 label / goto / if-goto / call、只在末尾 return、且 _returns_one_value 的叶子函数（因此不会递归），
+    若在某个调用点的展开代价 _inline_cost 不超过 max_cost，就用 _expand_inline 替换该处的 call
+    argument / local 映射到共享的 $INLINE.k static，叶子函数的展开不会嵌套，所以所有调用点可以共用
+    返回 (内联后的 vm_commands, {function_name: (每个调用点的代价, 调用点数)})；
+    不再被调用的函数留给之后的 prune_functions 删除
+    '''
+    inlined = {}
+    if not max_cost:
+        return vm_commands, inlined
+    leaves = {}  # function_name -> (file_name, n_locals, body)
+    for file_name, commands in vm_commands:
+        function_name = None
+        for command in commands:
+            if command.op == C_FUNCTION:
+                function_name = command.arg1
+                leaves[function_name] = (file_name, command.arg2, [])
+            elif function_name is not None:
+                leaves[function_name][2].append(command)
+    for function_name, (file_name, n_locals, body) in list(leaves.items()):
+        returns = [i for i, command in enumerate(body) if command.op == C_RETURN]
+        if returns != [len(body) - 1] or any(command.op in INLINE_BARRIER for command in body) or \
+                not _returns_one_value(body):
+            del leaves[function_name]
+
+    expanded = []
+    for file_name, commands in vm_commands:
+        out = []
+        for command in commands:
+            if command.op == C_CALL and command.arg1 in leaves:
+                callee_file, n_locals, body = leaves[command.arg1]
+                cost = _inline_cost(command.arg2, n_locals, body)
+                if cost <= max_cost and all(c.arg2 < command.arg2 for c in body if c.arg1 == 'argument'):
+                    out += _expand_inline(callee_file, command.arg2, n_locals, body)
+                    cost, sites = inlined.get(command.arg1, (cost, 0))
+                    inlined[command.arg1] = cost, sites + 1
+                    continue
+            out.append(command)
+        expanded.append((file_name, out))
+    return expanded, inlined
+
+
+def inline_report(inlined):
+    sites = sum(sites for _, sites in inlined.values())
+    return f'{len(inlined)} functions at {sites} call sites ' + \
+        str({function_name: f'cost {cost} x {sites}' for function_name, (cost, sites) in inlined.items()})
@@ -1,24 +1,16 @@
+import hashlib
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-COMMAND_TYPE = {
-    'add': 'C_ARITHMETIC',
-    'sub': 'C_ARITHMETIC',
-    'neg': 'C_ARITHMETIC',
-    'eq': 'C_ARITHMETIC',
-    'gt': 'C_ARITHMETIC',
-    'lt': 'C_ARITHMETIC',
-    'and': 'C_ARITHMETIC',
-    'or': 'C_ARITHMETIC',
-    'not': 'C_ARITHMETIC',
-    'push': 'C_PUSH',
-    'pop': 'C_POP',
-    'label': 'C_LABEL',
-    'goto': 'C_GOTO',
-    'if-goto': 'C_IF',
-    'function': 'C_FUNCTION',
-    'return': 'C_RETURN',
-    'call': 'C_CALL',
-}
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '07'))
+from VMCommand import (  # noqa: E402
+    C_ADD, C_SUB, C_NEG, C_EQ, C_GT, C_LT, C_AND, C_OR, C_NOT,
+    C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_CALL, C_RETURN, C_IF_NOT, C_TAIL_CALL, C_DISCARD, C_MOVE,
+    KEYWORD, VMCommand, parse_vm,
+)
+import VMLinker  # noqa: E402
+from BuildCache import BuildCache, source_digest  # noqa: E402
 
 MEMORY_SEGMENT = {
     'local': 'LCL',
@@ -28,22 +20,47 @@ MEMORY_SEGMENT = {
 }
 
 BI_OPS = {  # x -> M, y -> D
-    'add': ['D=D+M'],
-    'sub': ['D=M-D'],
-    'and': ['D=D&M'],
-    'or': ['D=D|M'],
+    C_ADD: ['D=D+M'],
+    C_SUB: ['D=M-D'],
+    C_AND: ['D=D&M'],
+    C_OR: ['D=D|M'],
 }
 
 BI_JMP = {  # x -> M, y -> D
-    'eq': 'D;JEQ',  # x == y
-    'gt': 'D;JGT',  # x > y
-    'lt': 'D;JLT',  # x < y
+    C_EQ: 'D;JEQ',  # x == y
+    C_GT: 'D;JGT',  # x > y
+    C_LT: 'D;JLT',  # x < y
 }
 
 
 U_OPS = {  # y -> D
-    'neg': ['D=-D'],
-    'not': ['D=!D'],
+    C_NEG: ['D=-D'],
+    C_NOT: ['D=!D'],
+}
+
+WORD_MASK = 0xFFFF
+CONSTANT_COMP = {0: '0', 1: '1', WORD_MASK: '-1'}  # ALU 可以直接算出的常量，不需要 @n
+SIGN_BIT = 0x8000
+A_ADDRESS_MAX = 0x7FFF
+SP_OFFSET_LIMIT = 4  # fixed_sp 模式下块内栈深度偏移的上限，超过后提前同步 SP，避免过长的 A=A+1 链
+LOCALS_UNROLL = 8  # function 的局部变量不超过该数量时逐个写 0，超过后用循环清零
+CACHE_NAME = '.vmcache.json'
+FOLD_BI_OPS = {  # 16 位字上的常量折叠，比较运算按有符号数
+    C_ADD: lambda x, y: (x + y) & WORD_MASK,
+    C_SUB: lambda x, y: (x - y) & WORD_MASK,
+    C_AND: lambda x, y: x & y,
+    C_OR: lambda x, y: x | y,
+    C_EQ: lambda x, y: WORD_MASK if x == y else 0,
+    C_GT: lambda x, y: WORD_MASK if (x ^ SIGN_BIT) > (y ^ SIGN_BIT) else 0,
+    C_LT: lambda x, y: WORD_MASK if (x ^ SIGN_BIT) < (y ^ SIGN_BIT) else 0,
+}
+FOLD_U_OPS = {
+    C_NEG: lambda y: -y & WORD_MASK,
+    C_NOT: lambda y: y ^ WORD_MASK,
+}
+BLOCK_BOUNDARY = frozenset([C_LABEL, C_GOTO, C_IF, C_IF_NOT, C_FUNCTION, C_CALL, C_RETURN, C_TAIL_CALL])
+FOLD_IDENTITY = {  # x op c == x
+    (C_ADD, 0), (C_SUB, 0), (C_OR, 0), (C_AND, WORD_MASK),
 }
 
 PATTERN = {
@@ -72,10 +89,368 @@ PATTERN = {
         'M=M+1',             # sp ++;
     ]
 }
+PATTERN['push_frame'] = [
+    '@LCL',
+    'D=M',
+] + PATTERN['push_D_in_stack'] + [  # push local
+    '@ARG',
+    'D=M',
+] + PATTERN['push_D_in_stack'] + [  # push argument
+    '@THIS',
+    'D=M',
+] + PATTERN['push_D_in_stack'] + [  # push this
+    '@THAT',
+    'D=M',
+] + PATTERN['push_D_in_stack']  # push that
+PATTERN['return'] = [  # R13 = endFrame, R14 = retAddr，不占用 static 区的变量
+        '@LCL',
+        'D=M',
+        '@R13',
+        'M=D',  # endFrame = LCL; D = LCL = endFrame
+        '@5',
+        'A=D-A',
+        'D=M',  # D = *(endFrame - 5)
+        '@R14',
+        'M=D',  # retAddr = D
+    ] + PATTERN['extract_y'] + [
+        '@ARG',
+        'A=M',
+        'M=D',  # *ARG = D = *pop()
+        '@ARG',
+        'D=M',
+        '@SP',
+        'M=D+1',  # SP = ARG + 1
+        '@R13',
+        'D=M',
+        '@1',
+        'A=D-A',
+        'D=M',
+        '@THAT',
+        'M=D',  # THAT = *(endFrame - 1)
+        '@R13',
+        'D=M',
+        '@2',
+        'A=D-A',
+        'D=M',
+        '@THIS',
+        'M=D',  # THIS = *(endFrame - 2)
+        '@R13',
+        'D=M',
+        '@3',
+        'A=D-A',
+        'D=M',
+        '@ARG',
+        'M=D',  # ARG = *(endFrame - 3)
+        '@R13',
+        'D=M',
+        '@4',
+        'A=D-A',
+        'D=M',
+        '@LCL',
+        'M=D',  # LCL = *(endFrame - 4)
+        '@R14',
+        'A=M',
+        '0;JMP',  # goto Addr
+]
+
+
+# 翻译器以及它从仓库中导入的模块（VMCommand 决定解析与 IR，VMLinker 决定整程序变换）的源码哈希作为版本号，
+# 修改其中任何一个后旧缓存自动失效
+TRANSLATOR_VERSION = source_digest(__file__, VMLinker.__file__, sys.modules[VMCommand.__module__].__file__)
+
+
+def _shortest(*candidates):
+    # 指令选择: 取最短的候选指令序列，等长时取靠前的一个
+    return min(candidates, key=len)
+
+
+def _c_fields(code):
+    # 'dest=comp;jump' -> (dest, comp, jump)，缺省部分为空串
+    comp, _, jump = code.partition(';')
+    dest, _, comp = comp.rpartition('=')
+    return dest, comp, jump
+
+
+def _is_a_only(code):
+    # 只改写 A 寄存器的指令，若紧接着又是 @X，则它的结果从未被使用
+    if code.startswith('@'):
+        return True
+    if code.startswith('('):
+        return False
+    dest, comp, jump = _c_fields(code)
+    return dest == 'A' and jump == ''
+
+
+def _next_a_val(a_val, comp):
+    # 写入 A 之后的符号值: A=M 时 'X' -> ('X', 0)，A=A+1 / A=A-1 时 ('X', k) -> ('X', k ± 1)，其余情况未知
+    if comp == 'M' and isinstance(a_val, str):
+        return a_val, 0
+    if comp in ('A+1', 'A-1') and isinstance(a_val, tuple):
+        return a_val[0], a_val[1] + (1 if comp == 'A+1' else -1)
+    return None
+
+
+def _slot_run(asm_codes, i):
+    # asm_codes[i:] 以 A=A+1 / A=A-1 开头的连续指令数及其累计偏移
+    length = offset = 0
+    while i + length < len(asm_codes) and asm_codes[i + length] in ('A=A+1', 'A=A-1'):
+        offset += 1 if asm_codes[i + length] == 'A=A+1' else -1
+        length += 1
+    return length, offset
+
+
+def _peephole_pass(asm_codes):
+    '''
+    顺序扫描一遍，跟踪 A 的符号值 a_val ('X' 表示 A=X，('X', k) 表示 A=M[X]+k) 以及 D 是否等于 M[A]
+    label 是跳转目标，遇到 label 时清空所有已知状态
+    假设指针不会指向自身（如 M[SP] != SP），这对合法的 VM 程序总是成立
+    '''
+    out = []
+    a_val = None
+    d_eq_m = False
+    i = 0
+    while i < len(asm_codes):
+        code = asm_codes[i]
+        i += 1
+        if code.startswith('('):
+            out.append(code)
+            a_val = None
+            d_eq_m = False
+            continue
+        if code.startswith('@'):
+            symbol = code[1:]
+            if a_val == symbol:  # A 已经是 X
+                continue
+            if isinstance(a_val, tuple) and a_val[0] == symbol and i < len(asm_codes) and asm_codes[i] == 'A=M':
+                # @X A=M 加上 k 条 A=A±1 重新定位 M[X]+k，而 A 已经是 M[X]+j，只需移动 k-j
+                length, offset = _slot_run(asm_codes, i + 1)
+                delta = offset - a_val[1]
+                if abs(delta) < 2 + length:
+                    i += 1 + length
+                    out += ['A=A+1' if delta > 0 else 'A=A-1'] * abs(delta)
+                    a_val = symbol, offset
+                    d_eq_m = d_eq_m and delta == 0
+                    continue
+            while out and _is_a_only(out[-1]):
+                out.pop()
+            out.append(code)
+            a_val = symbol
+            d_eq_m = False
+            continue
+        if code in ('D=M', 'M=D') and d_eq_m:  # 刚写入或读出过同一个值
+            continue
+        if out and (out[-1], code) in (('M=M+1', 'M=M-1'), ('M=M-1', 'M=M+1')):  # push 后紧接 pop，SP 调整相互抵消
+            out.pop()
+            d_eq_m = False
+            continue
+        out.append(code)
+        dest, comp, jump = _c_fields(code)
+        if 'A' in dest:
+            a_val = _next_a_val(a_val, comp)
+            d_eq_m = False
+        elif 'M' in dest:
+            d_eq_m = 'D' in dest or comp == 'D'
+        elif 'D' in dest:
+            d_eq_m = comp == 'M'
+    return out
+
+
+def _is_dead_stack_store(asm_codes, idx):
+    # asm_codes[idx] 是写入 M[SP] 的 M=D，若在 SP 改变或读取 M[SP] 之前又被覆盖，则栈顶以上的这个值不会被使用
+    a_val = 'SP', 0
+    for code in asm_codes[idx + 1:]:
+        if code.startswith('('):
+            return False
+        if code.startswith('@'):
+            a_val = code[1:]
+            continue
+        dest, comp, jump = _c_fields(code)
+        if jump != '' or ('M' in comp and (a_val is None or isinstance(a_val, tuple) and a_val[0] == 'SP')):
+            return False
+        if 'M' in dest:
+            if a_val == 'SP':
+                return False
+            if a_val == ('SP', 0):
+                return True
+        if 'A' in dest:
+            a_val = _next_a_val(a_val, comp)
+    return False
+
+
+def _is_constant(command):
+    return command.op == C_PUSH and command.arg1 == 'constant'
+
+
+def _fold_tail(commands):
+    # 尝试化简 commands 末尾的命令，成功返回 True；label 也是命令，因此不会跨 label 化简
+    if len(commands) < 2:
+        return False
+    prev, last = commands[-2], commands[-1]
+    if last.op in FOLD_U_OPS and prev.op == last.op:
+        del commands[-2:]  # not; not | neg; neg
+        return True
+    if not _is_constant(prev):
+        return False
+    c = prev.arg2
+    if last.op in FOLD_U_OPS:
+        commands[-2:] = [VMCommand(C_PUSH, 'constant', FOLD_U_OPS[last.op](c))]
+    elif last.op in FOLD_BI_OPS and len(commands) >= 3 and _is_constant(commands[-3]):
+        commands[-3:] = [VMCommand(C_PUSH, 'constant', FOLD_BI_OPS[last.op](commands[-3].arg2, c))]
+    elif (last.op, c) in FOLD_IDENTITY:
+        del commands[-2:]
+    elif last.op == C_IF:  # 条件已知的跳转
+        commands[-2:] = [VMCommand(C_GOTO, last.arg1)] if c else []
+    else:
+        return False
+    return True
+
+
+def fold_constants(commands):
+    '''
+    在 _code_writer 之前对解析后的 VMCommand 做常量折叠与代数化简:
+    push constant a; push constant b; op -> push constant (a op b)，一元运算同理
+    x + 0、x - 0、x | 0、x & -1、not; not、neg; neg 直接删除
+    push constant c; if-goto L -> goto L 或删除；not; if-goto L -> 栈顶为 0 时跳转的 C_IF_NOT L
+    折叠得到的常量是 0 ~ 65535 的 16 位字，由 _constant 负责生成超出 @ 范围的值
+    '''
+    out = []
+    for command in commands:
+        if command.op == C_IF and out and out[-1].op == C_NOT:
+            out[-1] = VMCommand(C_IF_NOT, command.arg1)
+        else:
+            out.append(command)
+        while _fold_tail(out):
+            pass
+    return out
+
+
+def _is_temp0(command, op):
+    return command.op == op and command.arg1 == 'temp' and command.arg2 == 0
+
+
+def _temp0_is_scratch(commands):
+    # JackCompiler 只把 temp 0 当作块内的中转: 每个 push temp 0 之前同一基本块内都有 pop temp 0
+    written = False
+    for command in commands:
+        if command.op in BLOCK_BOUNDARY:
+            written = False
+        elif _is_temp0(command, C_POP):
+            written = True
+        elif _is_temp0(command, C_PUSH) and not written:
+            return False
+    return True
+
+
+def _temp0_is_dead(commands, i):
+    # commands[i] 写入的 temp 0 在本基本块内被读取之前又被覆盖或到达块边界
+    for command in commands[i + 1:]:
+        if command.op in BLOCK_BOUNDARY or _is_temp0(command, C_POP):
+            return True
+        if _is_temp0(command, C_PUSH):
+            return False
+    return True
+
+
+def fuse_calls(commands, tail_calls=False, discard_temp=False):
+    '''
+    在 fold_constants 之后合并 call 与紧随其后的命令:
+    call f n; return     -> tail-call f n，tail_calls 时复用当前栈帧，见 _stubs 中的 $TAIL
+    call f n; pop temp 0 -> call f n; discard，do 语句丢弃返回值，只需 SP - 1；
+                           temp 0 不再被写入，因此只在 discard_temp 时进行，即 temp 0 只是 JackCompiler 的块内中转、
+                           不会被外部观察；同时要求文件满足 _temp0_is_scratch，且写入的值在块内不会被读取
+    '''
+    scratch = discard_temp and _temp0_is_scratch(commands)
+    out = []
+    for i, command in enumerate(commands):
+        if out and out[-1].op == C_CALL:
+            if tail_calls and command.op == C_RETURN:
+                out[-1] = VMCommand(C_TAIL_CALL, out[-1].arg1, out[-1].arg2)
+                continue
+            if scratch and _is_temp0(command, C_POP) and _temp0_is_dead(commands, i):
+                out.append(VMCommand(C_DISCARD))
+                continue
+        out.append(command)
+    return out
+
+
+def fuse_moves(commands):
+    # push x; pop y -> move，值经 D 直接从 x 传送到 y；常量 0 / 1 / -1 直接写入 y
+    out = []
+    for command in commands:
+        if command.op == C_POP and out and out[-1].op == C_PUSH:
+            out[-1] = VMCommand(C_MOVE, out[-1], command)
+        else:
+            out.append(command)
+    return out
+
+
+def peephole(asm_codes):
+    '''
+    对 _code_writer 生成的汇编做窥孔优化，重复执行直到不再变化:
+    相互抵消的 SP++ / SP--、冗余的 A 寄存器重载、写入后立即读回、结果未被使用的 A 赋值、被覆盖的栈顶写入
+    返回 (优化后的 asm_codes, 删除的指令数)
+    '''
+    origin_size = size = len(asm_codes)
+    while True:
+        asm_codes = _peephole_pass(asm_codes)
+        asm_codes = [
+            code for idx, code in enumerate(asm_codes)
+            if not (code == 'M=D' and asm_codes[idx - 2:idx] == ['@SP', 'A=M'] and _is_dead_stack_store(asm_codes, idx))
+        ]
+        if len(asm_codes) == size:
+            break
+        size = len(asm_codes)
+    return asm_codes, origin_size - size
 
 
 class VMtranslator:
-    def __init__(self):
+    def __init__(self, optimize=False, shared_stubs=False, prune=False, cache_tos=False, fixed_sp=False, use_cache=False,
+                 discard_temp=False, inline=0):
+        self.optimize = optimize  # 是否做 VM 命令的常量折叠以及生成汇编的 peephole 优化
+        self.shared_stubs = shared_stubs  # 代码体积模式: call / return / eq gt lt 跳转到 _stubs 中的共享例程
+        self.prune = prune  # 目录模式下删除从 Sys.init 不可达的函数
+        self.cache_tos = cache_tos  # 基本块内把栈顶缓存在 D 寄存器中，见 _block_writer
+        self.fixed_sp = fixed_sp  # 基本块内按静态栈深度寻址，每块只调整一次 SP，见 _block_writer
+        self.use_cache = use_cache  # translate_files 按文件缓存汇编，见 BuildCache
+        # temp 0 只是 JackCompiler 的中转，丢弃返回值时可以不写入，见 fuse_calls；只在 optimize 时生效
+        # 会改变可观察的 temp 0，08 的 NestedCall 检查 temp 0，开启后与 .cmp 不一致，因此只由 JackBuilder 打开
+        self.discard_temp = discard_temp
+        self.inline = inline  # 目录模式下内联展开代价不超过该值的叶子函数，0 表示不内联，见 inline_functions
+        self.caches = {}  # 目录 -> BuildCache
+        self.translated = []  # 最近一次 translate_files 中缓存未命中、真正重新翻译的文件名
+        self.statics = {}  # link_statics 分配的 'File.i' -> RAM 地址，为空时 static 留给汇编器分配
+        self.pruned = []  # 最近一次 prune_functions 删除的函数名
+        self.inlined = {}  # 最近一次 inline_functions 内联的函数名 -> (每个调用点的代价, 调用点数)
+        self.removed = 0  # peephole 累计删除的指令数
+        self.folded = 0  # fold_constants 累计删除的 VM 命令数
+        self.fused = 0  # fuse_calls / fuse_moves 累计生成的合并命令数
+        # 操作码 -> 生成函数，_code_writer / _block_writer 查表分派
+        self._emitters = {op: self._arithmetic for op in list(BI_OPS) + list(BI_JMP) + list(U_OPS)}
+        self._emitters.update({
+            C_PUSH: self._push,
+            C_POP: self._pop,
+            C_LABEL: self._label,
+            C_GOTO: self._goto,
+            C_IF: self._if,
+            C_IF_NOT: self._if,
+            C_FUNCTION: self._function,
+            C_CALL: self._call,
+            C_RETURN: self._return,
+            C_TAIL_CALL: self._tail_call,
+            C_DISCARD: self._discard,
+            C_MOVE: self._move,
+        })
+        self._block_emitters = {op: self._block_binary for op in BI_OPS}  # 其余操作码都是块边界
+        self._block_emitters.update({op: self._block_compare for op in BI_JMP})
+        self._block_emitters.update({op: self._block_unary for op in U_OPS})
+        self._block_emitters.update({
+            C_PUSH: self._block_push,
+            C_POP: self._block_pop,
+            C_DISCARD: self._block_discard,
+            C_MOVE: self._block_move,
+            C_IF: self._block_if,
+            C_IF_NOT: self._block_if,
+        })
         self._cfg_reset()
 
     def _cfg_reset(self):
@@ -83,23 +458,10 @@ class VMtranslator:
         self.jmp_cnt = 0
         self.function_name = None
         self.function_ret_cnt = 0
+        self.tos_in_d = False
+        self.sp_offset = 0
 
-    def _ignore_white_space(self, vm_code):
-        return vm_code.split('//')[0].strip()
-
-    def _parser(self, vm_code):
-        vm_code_tokens = vm_code.split()
-        command_type = COMMAND_TYPE[vm_code_tokens[0]]
-        arg1 = vm_code_tokens[0] if command_type == 'C_ARITHMETIC' else None  # C_RETURN
-        arg2 = None
-        if len(vm_code_tokens) > 1:  # C_PUSH, C_POP, C_LABEL, C_IF, C_GOTO,  C_FUNCTION, C_CALL
-            arg1 = vm_code_tokens[1]
-        if len(vm_code_tokens) > 2:  # C_PUSH, C_POP, C_FUNCTION, C_CALL
-            arg2 = int(vm_code_tokens[2])
-        # print(command_type, arg1, arg2)
-        return command_type, arg1, arg2
-
-    def _BI_JMP(self, arg1):
+    def _BI_JMP(self, op):
         # 这部分是为了服务与二元布尔值计算使用的 jump label
         # jmp_cnt 标记可以满足 同一个文件内的所有 jump label 唯一
         # file_name 标记可以满足 跨文件的所有 jump lable 唯一
@@ -107,7 +469,7 @@ class VMtranslator:
         return [
             'D=M-D',
             f'@{self.file_name}$conditiontrue.{self.jmp_cnt}',
-            BI_JMP[arg1],
+            BI_JMP[op],
             'D=0',                 # false D = 0 = 00000...
             f'@{self.file_name}$nextinstruction.{self.jmp_cnt}',
             '0;JMP',
@@ -116,267 +478,652 @@ class VMtranslator:
             f'({self.file_name}$nextinstruction.{self.jmp_cnt})'
         ]
 
-    def _memory_segment(self, command_type, arg1, arg2):
-        # 计算 根地址偏移量需要用 D，抽取栈变量也需要用到 D，先抽取后访问 D 会变污染
-        # 当前解决方案是建立中转指针tempAddr
-        if arg2 == 0:
+    def _constant(self, arg2):  # only C_PUSH
+        if arg2 in CONSTANT_COMP:
             return [
-                f'@{MEMORY_SEGMENT[arg1]}',
-                'A=M',
-                {'C_PUSH': 'D=M', 'C_POP': 'M=D'}[command_type],
+                f'D={CONSTANT_COMP[arg2]}',
             ]
-        else:
-            if command_type == 'C_PUSH':
+        if arg2 > A_ADDRESS_MAX:  # fold_constants 得到的 16 位字，@ 只能装入 15 位
+            if -arg2 & WORD_MASK <= A_ADDRESS_MAX:
                 return [
-                    f'@{arg2}',
-                    'D=A',
+                    f'@{-arg2 & WORD_MASK}',
+                    'D=-A',
+                ]
+            return [
+                f'@{arg2 ^ WORD_MASK}',
+                'D=!A',
+            ]
+        return [
+            f'@{arg2}',
+            'D=A',
+        ]
+
+    def _direct(self, arg1, arg2):  # temp / static / pointer 的地址在翻译时已知，一条 @ 指令即可定位
+        if arg1 == 'temp':
+            return f'@{5 + arg2}'
+        elif arg1 == 'static':
+            static_name = VMLinker.static_name(self.file_name, arg2)
+            return f'@{self.statics.get(static_name, static_name)}'
+        elif arg1 == 'pointer':
+            return '@THIS' if arg2 == 0 else '@THAT'
+
+    def _load_D(self, arg1, arg2):  # D = segment[arg2]
+        if arg1 in MEMORY_SEGMENT:
+            return _shortest(
+                [
                     f'@{MEMORY_SEGMENT[arg1]}',
-                    'A=M+D',
+                    'A=M',
+                ] + ['A=A+1'] * arg2 + [
                     'D=M',
-                ]
-            elif command_type == 'C_POP':  # D Conflict
-                return [
+                ],
+                [
                     f'@{arg2}',
                     'D=A',
                     f'@{MEMORY_SEGMENT[arg1]}',
-                    'D=M+D',
-                    '@tempAddr',
-                    'M=D',
-                ] + PATTERN['extract_y'] + [
-                    '@tempAddr',
-                    'A=M',
-                    'M=D',
-                ]
+                    'A=M+D',
+                    'D=M',
+                ],
+            )
+        elif arg1 == 'constant':
+            return self._constant(arg2)
+        return [
+            self._direct(arg1, arg2),
+            'D=M',
+        ]
 
-    def _temp(self, command_type, arg2):
-        if arg2 == 0:
+    def _store_D(self, arg1, arg2, comp='D'):
+        # segment[arg2] = comp，comp 为 D 时不改变 D；comp 为 CONSTANT_COMP 中的常量时 D 可以用来计算地址
+        if arg1 not in MEMORY_SEGMENT:
             return [
-                f'@5',
-                {'C_PUSH': 'D=M', 'C_POP': 'M=D'}[command_type],
+                self._direct(arg1, arg2),
+                f'M={comp}',
             ]
-        else:
-            if command_type == 'C_PUSH':
-                return [
-                    f'@{arg2}',
-                    'D=A',
-                    f'@5',
-                    'A=A+D',
-                    'D=M',
-                ]
-            elif command_type == 'C_POP':  # D Conflict
-                return [
-                    f'@{arg2}',
-                    'D=A',
-                    f'@5',
-                    'D=A+D',
-                    '@tempAddr',
-                    'M=D',
-                ] + PATTERN['extract_y'] + [
-                    '@tempAddr',
-                    'A=M',
-                    'M=D',
-                ]
+        unrolled = [
+            f'@{MEMORY_SEGMENT[arg1]}',
+            'A=M',
+        ] + ['A=A+1'] * arg2 + [
+            f'M={comp}',
+        ]
+        if comp != 'D':
+            return _shortest(unrolled, [
+                f'@{arg2}',
+                'D=A',
+                f'@{MEMORY_SEGMENT[arg1]}',
+                'A=M+D',
+                f'M={comp}',
+            ])
+        return _shortest(unrolled, [
+            '@R13',
+            'M=D',  # R13 = y
+            f'@{MEMORY_SEGMENT[arg1]}',
+            'D=D+M',
+            f'@{arg2}',
+            'D=D+A',  # D = y + segment + arg2
+            '@R13',
+            'A=D-M',  # A = segment + arg2
+            'D=D-A',  # D = y
+            'M=D',
+        ])
 
-    def _constant(self, arg2):  # only C_PUSH
+    def _slot(self, offset):  # A = RAM[SP] + offset
+        if not self.fixed_sp:
+            return ['@SP', 'A=M']
+        return ['@SP', 'A=M'] + (['A=A+1'] * offset if offset > 0 else ['A=A-1'] * -offset)
+
+    def _sync_sp(self, keep_d=False):  # 把块内累计的栈深度一次性写回 SP
+        offset, self.sp_offset = self.sp_offset, 0
+        if offset == 0:
+            return []
+        if keep_d or abs(offset) <= 2:
+            return ['@SP'] + ['M=M+1' if offset > 0 else 'M=M-1'] * abs(offset)
         return [
-            f'@{arg2}',
+            f'@{abs(offset)}',
             'D=A',
+            '@SP',
+            'M=M+D' if offset > 0 else 'M=M-D',
         ]
 
-    def _static(self, command_type, arg2):
-        return [
-            f'@{self.file_name}.{arg2}',
-            {'C_PUSH': 'D=M', 'C_POP': 'M=D'}[command_type],
-        ]
+    def _spill(self):  # 把缓存在 D 中的栈顶写回 RAM
+        if not self.tos_in_d:
+            return []
+        self.tos_in_d = False
+        if not self.fixed_sp:
+            return PATTERN['push_D_in_stack']
+        asm_code = self._slot(self.sp_offset) + ['M=D']
+        self.sp_offset += 1
+        if self.sp_offset > SP_OFFSET_LIMIT:
+            asm_code += self._sync_sp()
+        return asm_code
 
-    def _pointer(self, command_type, arg2):
-        arg = 'THIS' if arg2 == 0 else 'THAT'
-        return [
-            f'@{arg}',
-            {'C_PUSH': 'D=M', 'C_POP': 'M=D'}[command_type],
+    def _pop_A(self):  # 弹出栈顶，A 指向它所在的 RAM
+        if not self.fixed_sp:
+            return ['@SP', 'AM=M-1']
+        if self.sp_offset <= -SP_OFFSET_LIMIT:  # 二元运算时 D 中是 y，不能用 D 同步
+            return self._sync_sp(keep_d=True) + self._pop_A()
+        self.sp_offset -= 1
+        return self._slot(self.sp_offset)
+
+    def _fetch_y(self):  # 弹出栈顶到 D
+        if self.tos_in_d:
+            self.tos_in_d = False
+            return []
+        return self._pop_A() + ['D=M']
+
+    def _block_push(self, command):
+        asm_code = self._spill() + self._load_D(command.arg1, command.arg2)
+        self.tos_in_d = True
+        return asm_code
+
+    def _block_pop(self, command):
+        return self._fetch_y() + self._store_D(command.arg1, command.arg2)
+
+    def _block_discard(self, command):
+        if self.tos_in_d:
+            self.tos_in_d = False
+            return []
+        if not self.fixed_sp:
+            return self._discard(command)
+        asm_code = self._sync_sp() if self.sp_offset <= -SP_OFFSET_LIMIT else []
+        self.sp_offset -= 1
+        return asm_code
+
+    def _block_move(self, command):
+        return self._spill() + self._move(command)
+
+    def _block_unary(self, command):
+        asm_code = self._fetch_y() + U_OPS[command.op]
+        self.tos_in_d = True
+        return asm_code
+
+    def _block_binary(self, command):  # x -> M, y -> D
+        op = command.op
+        asm_code = self._fetch_y() + self._pop_A() + (BI_OPS[op] if op in BI_OPS else self._BI_JMP(op))
+        self.tos_in_d = True
+        return asm_code
+
+    def _block_compare(self, command):
+        if self.shared_stubs:  # 跳转到共享的比较例程，与块边界一样需要完整的栈
+            return self._block_boundary(command)
+        return self._block_binary(command)
+
+    def _block_if(self, command):
+        return self._fetch_y() + self._sync_sp(keep_d=True) + [
+            f'@{self.function_name}${command.arg1}',
+            'D;JNE' if command.op == C_IF else 'D;JEQ',
         ]
 
-    def _code_writer(self, command_type, arg1, arg2):
-        asm_code = []
-        if command_type == 'C_ARITHMETIC':
-            if arg1 in BI_OPS:
-                asm_code = PATTERN['extract_x_y'] + BI_OPS[arg1]
-            elif arg1 in BI_JMP:
-                asm_code = PATTERN['extract_x_y'] + self._BI_JMP(arg1)
-            elif arg1 in U_OPS:
-                asm_code = PATTERN['extract_y'] + U_OPS[arg1]
-            asm_code += PATTERN['push_D_in_stack']
-        elif command_type == 'C_PUSH':  # D <- M Then Stack <- D
-            if arg1 in MEMORY_SEGMENT:
-                asm_code = self._memory_segment('C_PUSH', arg1,  arg2)
-            elif arg1 == 'temp':
-                asm_code = self._temp('C_PUSH', arg2)
-            elif arg1 == 'constant':
-                asm_code = self._constant(arg2)
-            elif arg1 == 'static':
-                asm_code = self._static('C_PUSH', arg2)
-            elif arg1 == 'pointer':
-                asm_code = self._pointer('C_PUSH', arg2)
-            asm_code += PATTERN['push_D_in_stack']
-        elif command_type == 'C_POP':  # D <- Stack Then M <- D
-            if arg1 in MEMORY_SEGMENT:
-                asm_code = self._memory_segment('C_POP', arg1, arg2)
-            elif arg1 == 'temp':
-                asm_code = self._temp('C_POP', arg2)
-            elif arg1 == 'static':
-                asm_code = self._static('C_POP', arg2)
-            elif arg1 == 'pointer':
-                asm_code = self._pointer('C_POP', arg2)
-
-            if not ((arg1 in MEMORY_SEGMENT or arg1 == 'temp') and arg2 > 0):  # if not D-conflict:
-                asm_code = PATTERN['extract_y'] + asm_code
-        elif command_type == 'C_GOTO':
-            asm_code = [
-                f'@{self.function_name}${arg1}',
+    def _block_boundary(self, command):
+        return self._spill() + self._sync_sp() + self._code_writer(command)
+
+    def _block_writer(self, command):
+        '''
+        基本块内的代码生成，由两个相互独立的开关控制:
+        cache_tos: self.tos_in_d 为 True 时逻辑栈顶保存在 D 中，push / pop / 运算直接在 D 上进行
+        fixed_sp: 块内的栈深度在翻译时已知，记录在 self.sp_offset 中，栈槽按 RAM[SP] + offset 直接寻址，
+                  SP 只在块结束时调整一次
+        label / goto / call / return / function 是块边界，进入前先写回 D 并同步 SP，栈完整地保存在 RAM 中
+        '''
+        asm_code = self._block_emitters.get(command.op, self._block_boundary)(command)
+        if not self.cache_tos:
+            asm_code += self._spill()
+        return asm_code
+
+    def _arithmetic(self, command):
+        op = command.op
+        if op in BI_OPS:
+            asm_code = PATTERN['extract_x_y'] + BI_OPS[op]
+        elif op in BI_JMP and self.shared_stubs:
+            self.jmp_cnt += 1
+            return [
+                f'@{self.file_name}$nextinstruction.{self.jmp_cnt}',
+                'D=A',
+                f'@$CMP.{KEYWORD[op]}',
                 '0;JMP',
+                f'({self.file_name}$nextinstruction.{self.jmp_cnt})',
             ]
-        elif command_type == 'C_LABEL':
-            asm_code = [
-                f'({self.function_name}${arg1})'
-            ]
-        elif command_type == 'C_IF':
-            asm_code = PATTERN['extract_y'] + [
-                f'@{self.function_name}${arg1}',
-                'D;JNE',  # if cond means if cond != 0
-            ]
-        elif command_type == 'C_CALL':
-            # 采用隐藏规则 .vm 内函数名规则 fileName.functionName，故不额外补充名称
-            retAddressLabel = f'{self.function_name}$ret.{self.function_ret_cnt}'
-            self.function_ret_cnt += 1
+        elif op in BI_JMP:
+            asm_code = PATTERN['extract_x_y'] + self._BI_JMP(op)
+        else:
+            asm_code = PATTERN['extract_y'] + U_OPS[op]
+        return asm_code + PATTERN['push_D_in_stack']
 
-            asm_code = [
-                f'@{retAddressLabel}',
-                'D=A',
-            ] + PATTERN['push_D_in_stack'] + [  # push retAddressLabel
-                '@LCL',
-                'D=M',
-            ] + PATTERN['push_D_in_stack'] + [  # push local
-                '@ARG',
-                'D=M',
-            ] + PATTERN['push_D_in_stack'] + [  # push argument
-                '@THIS',
-                'D=M',
-            ] + PATTERN['push_D_in_stack'] + [  # push this
-                '@THAT',
-                'D=M',
-            ] + PATTERN['push_D_in_stack'] + [  # push that
+    def _push(self, command):  # D <- M Then Stack <- D
+        if command.arg1 == 'constant' and command.arg2 in CONSTANT_COMP:  # 常量直接写入栈顶
+            return [
                 '@SP',
-                'D=M',
-                '@5',
-                'D=D-A',
-                f'@{arg2}',
-                'D=D-A',
-                '@ARG',
-                'M=D',  # ARG = SP - 5 - nArgs
+                'A=M',
+                f'M={CONSTANT_COMP[command.arg2]}',
                 '@SP',
-                'D=M',
-                '@LCL',
-                'M=D',  # LCL = SP
-                f'@{arg1}',
-                '0;JMP',  # goto function
-                f'({retAddressLabel})',  # set retAddressLabel
+                'M=M+1',
             ]
-        elif command_type == 'C_FUNCTION':
-            # 所有 .vm 文件内都只有函数，return不能代表一个函数的结束
-            # 直到遇见下一个函数才能重制计数器与函数名
-
-            self.function_name = arg1
-            self.function_ret_cnt = 0
-            asm_code = [
-                f'({self.function_name})',
+        return self._load_D(command.arg1, command.arg2) + PATTERN['push_D_in_stack']
+
+    def _pop(self, command):  # D <- Stack Then M <- D
+        arg1, arg2 = command.arg1, command.arg2
+        if arg1 not in MEMORY_SEGMENT:
+            return PATTERN['extract_y'] + self._store_D(arg1, arg2)
+        # 计算地址需要用 D，而弹出的 y 仍保存在 RAM[SP] 中，可以用 D = 地址 + y 再减去 y 同时得到两者
+        return _shortest(PATTERN['extract_y'] + self._store_D(arg1, arg2), [
+            f'@{arg2}',
+            'D=A',
+            f'@{MEMORY_SEGMENT[arg1]}',
+            'D=D+M',  # D = segment + arg2
+            '@SP',
+            'AM=M-1',
+            'D=D+M',  # D = segment + arg2 + y
+            'A=D-M',  # A = segment + arg2
+            'D=D-A',  # D = y
+            'M=D',
+        ])
+
+    def _move(self, command):  # fuse_moves 生成的 push x; pop y，经 D 直接传送，不经过栈
+        source, target = command.arg1, command.arg2
+        if source.arg1 == 'constant' and source.arg2 in CONSTANT_COMP:
+            return self._store_D(target.arg1, target.arg2, CONSTANT_COMP[source.arg2])
+        return self._load_D(source.arg1, source.arg2) + self._store_D(target.arg1, target.arg2)
+
+    def _goto(self, command):
+        return [
+            f'@{self.function_name}${command.arg1}',
+            '0;JMP',
+        ]
+
+    def _label(self, command):
+        return [
+            f'({self.function_name}${command.arg1})'
+        ]
+
+    def _if(self, command):
+        return PATTERN['extract_y'] + [
+            f'@{self.function_name}${command.arg1}',
+            'D;JNE' if command.op == C_IF else 'D;JEQ',  # if cond means if cond != 0，C_IF_NOT 为 fold_constants 生成的 not; if-goto
+        ]
+
+    def _call(self, command):
+        # 采用隐藏规则 .vm 内函数名规则 fileName.functionName，故不额外补充名称
+        retAddressLabel = f'{self.function_name}$ret.{self.function_ret_cnt}'
+        self.function_ret_cnt += 1
+
+        if self.shared_stubs:
+            return [
+                f'@{command.arg2}',
+                'D=A',
+                '@R13',
+                'M=D',  # R13 = nArgs
+                f'@{command.arg1}',
+                'D=A',
+                '@R14',
+                'M=D',  # R14 = function
+                f'@{retAddressLabel}',
+                'D=A',  # D = retAddressLabel
+                '@$CALL',
+                '0;JMP',
+                f'({retAddressLabel})',
             ]
-            for i in range(arg2):  # set all locals = 0
-                asm_code += [
-                    '@0',
-                    'D=A',
-                ] + PATTERN['push_D_in_stack']
-        elif command_type == 'C_RETURN':
-            asm_code = [
-                '@LCL',
-                'D=M',
-                '@endFrame',
-                'M=D',  # endFrame = LCL; D = LCL = endFrame
-                '@5',
-                'A=D-A',
-                'D=M',  # D = *(endFrame - 5)
-                '@retAddr',
-                'M=D',  # retAddr = D
-            ] + PATTERN['extract_y'] + [
-                '@ARG',
-                'A=M',
-                'M=D',  # *ARG = D = *pop()
-                '@ARG',
-                'D=M',
+        return [
+            f'@{retAddressLabel}',
+            'D=A',
+        ] + PATTERN['push_D_in_stack'] + PATTERN['push_frame'] + [  # push retAddressLabel, LCL, ARG, THIS, THAT
+            '@SP',
+            'D=M',
+            '@5',
+            'D=D-A',
+            f'@{command.arg2}',
+            'D=D-A',
+            '@ARG',
+            'M=D',  # ARG = SP - 5 - nArgs
+            '@SP',
+            'D=M',
+            '@LCL',
+            'M=D',  # LCL = SP
+            f'@{command.arg1}',
+            '0;JMP',  # goto function
+            f'({retAddressLabel})',  # set retAddressLabel
+        ]
+
+    def _tail_call(self, command):
+        # call f n; return: 参数与当前函数保存的调用者栈帧一起搬到 ARG 处，f 返回时直接回到当前函数的调用者
+        return [
+            f'@{command.arg2}',
+            'D=A',
+            '@R13',
+            'M=D',  # R13 = nArgs
+            f'@{command.arg1}',
+            'D=A',
+            '@R14',
+            'M=D',  # R14 = function
+            '@$TAIL',
+            '0;JMP',
+        ]
+
+    def _discard(self, command):  # call f n; pop temp 0 中被丢弃的返回值
+        return [
+            '@SP',
+            'M=M-1',
+        ]
+
+    def _function(self, command):
+        # 所有 .vm 文件内都只有函数，return不能代表一个函数的结束
+        # 直到遇见下一个函数才能重制计数器与函数名
+
+        self.function_name = command.arg1
+        self.function_ret_cnt = 0
+        return [
+            f'({self.function_name})',
+        ] + self._init_locals(command.arg2)
+
+    def _init_locals(self, n_locals):
+        # set all locals = 0: 少量局部变量沿 A=A+1 逐个写 0 后一次性调整 SP，较多时用循环逐个压入 0
+        if n_locals == 0:
+            return []
+        if n_locals > LOCALS_UNROLL:
+            return [
+                f'@{n_locals}',
+                'D=A',
+                f'({self.function_name}$$locals)',
                 '@SP',
-                'M=D+1',  # SP = ARG + 1
-                '@endFrame',
-                'D=M',
-                '@1',
-                'A=D-A',
-                'D=M',
-                '@THAT',
-                'M=D',  # THAT = *(endFrame - 1)
-                '@endFrame',
-                'D=M',
-                '@2',
-                'A=D-A',
-                'D=M',
-                '@THIS',
-                'M=D',  # THIS = *(endFrame - 2)
-                '@endFrame',
-                'D=M',
-                '@3',
-                'A=D-A',
-                'D=M',
-                '@ARG',
-                'M=D',  # ARG = *(endFrame - 3)
-                '@endFrame',
-                'D=M',
-                '@4',
-                'A=D-A',
-                'D=M',
-                '@LCL',
-                'M=D',  # LCL = *(endFrame - 4)
-                '@retAddr',
-                'A=M',
-                '0;JMP',  # goto Addr
+                'AM=M+1',
+                'A=A-1',
+                'M=0',  # push 0
+                'D=D-1',
+                f'@{self.function_name}$$locals',
+                'D;JGT',
             ]
-            # self.function_name = None  # return 必然意味着退出了一个函数的编译，进入全局空间
-        return asm_code
+        asm_code = ['@SP', 'A=M'] + ['M=0', 'A=A+1'] * n_locals
+        if n_locals <= 2:
+            return asm_code[:-1] + ['@SP'] + ['M=M+1'] * n_locals
+        return asm_code[:-1] + [
+            'D=A+1',
+            '@SP',
+            'M=D',  # SP += n_locals
+        ]
+
+    def _return(self, command):
+        return ['@$RETURN', '0;JMP'] if self.shared_stubs else PATTERN['return']
+
+    def _code_writer(self, command):
+        return self._emitters[command.op](command)
 
     def translate_file(self, vm_path, write_asm_file=True):
+        head, tail = os.path.split(vm_path)
+        file_name, ext = os.path.splitext(tail)
+        asm_path = os.path.join(head, file_name + '.asm')
+        self.statics = {}  # 单个文件不经过链接，static 由汇编器分配
         with open(vm_path, 'r', encoding='utf8') as fpr:
-            head, tail = os.path.split(vm_path)
-            self.file_name, ext = os.path.splitext(tail)
-            asm_path = os.path.join(head, self.file_name + '.asm')
-            asm_codes = []
-            for vm_code in fpr:
-                vm_code = self._ignore_white_space(vm_code)
-                if len(vm_code) > 0:
-                    command_type, arg1, arg2 = self._parser(vm_code)
-                    asm_code = self._code_writer(command_type, arg1, arg2)
-                    asm_codes += asm_code
-        self._cfg_reset()
+            asm_codes = self.translate_vm(fpr, file_name)
 
         if write_asm_file:
+            asm_codes = self._with_stubs(asm_codes)
             with open(asm_path, 'w', encoding='utf8') as fpw:
                 fpw.writelines([code + '\n' for code in asm_codes])
         return asm_codes
 
+    def _with_stubs(self, asm_codes):
+        if self.shared_stubs:  # 单个 .vm 文件没有 boot，共享例程放在开头并跳过
+            return self._optimize(['@$STUBS.END', '0;JMP'] + self._stubs() + ['($STUBS.END)']) + asm_codes
+        return asm_codes
+
+    def translate_vm(self, vm_codes, file_name):
+        # vm_codes 为任意可迭代的 VM 命令行，例如 VMWriter.vm，不经过文件
+        return self.translate_commands(parse_vm(vm_codes), file_name)
+
+    def translate_commands(self, commands, file_name):
+        # commands 为 parse_vm 得到的 [VMCommand, ...]，常量折叠与代码生成都在 IR 上进行
+        self.file_name = file_name
+        if self.optimize:
+            folded = fold_constants(commands)
+            self.folded += len(commands) - len(folded)
+            commands = fuse_moves(fuse_calls(folded, self.shared_stubs, self.discard_temp))
+            self.fused += sum(command.op in (C_TAIL_CALL, C_DISCARD, C_MOVE) for command in commands)
+        asm_codes = []
+        code_writer = self._block_writer if self.cache_tos or self.fixed_sp else self._code_writer
+        for command in commands:
+            asm_codes += code_writer(command)
+        asm_codes += self._spill() + self._sync_sp()
+        self._cfg_reset()
+        return self._optimize(asm_codes)
+
+    def _options(self):
+        # 影响生成代码的选项，用于缓存的键以及在工作进程中重建 VMtranslator
+        return {
+            'optimize': self.optimize,
+            'shared_stubs': self.shared_stubs,
+            'prune': self.prune,
+            'cache_tos': self.cache_tos,
+            'fixed_sp': self.fixed_sp,
+            'discard_temp': self.discard_temp,
+        }
+
+    def _cache_of(self, cache_dir):
+        cache_dir = os.path.abspath(cache_dir)
+        if cache_dir not in self.caches:
+            self.caches[cache_dir] = BuildCache(os.path.join(cache_dir, CACHE_NAME), TRANSLATOR_VERSION, self._digest)
+        return self.caches[cache_dir]
+
+    def _digest(self, file_name, commands):
+        # 剪枝与常量折叠都会改变命令，因此对实际翻译的命令而不是 .vm 源码求哈希；static 地址取决于其他文件，一并计入
+        statics = [(name, self.statics[name]) for name in VMLinker.file_statics(file_name, commands)]
+        text = '\n'.join([repr(sorted(self._options().items())), repr(statics)] + [repr(command) for command in commands])
+        return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+    def link_statics(self, vm_commands):
+        # 统一分配所有文件的 static 地址，之后 _direct 直接输出数字地址，汇编器不再需要为 static 分配变量
+        self.statics = VMLinker.link_statics(vm_commands)
+        return self.statics
+
+    def static_report(self):
+        return VMLinker.static_report(self.statics)
+
+    def translate_files(self, vm_commands, jobs=1, cache_dir=None):
+        '''
+        vm_commands 为 [(file_name, [VMCommand, ...]), ...]，返回 _boot 之后按 vm_commands 顺序连接各文件汇编的结果
+        jobs 为进程数，None 表示使用全部 CPU，1 表示在当前进程内顺序翻译
+        文件之间的 label 都带有 file_name / function_name 前缀，各文件可以独立翻译，输出与顺序翻译完全一致
+        use_cache 且给出 cache_dir 时，命令与选项都未变的文件直接取缓存，只有未命中的文件才会重新翻译
+        翻译之前先由 link_statics 统一分配所有文件的 static 地址
+        '''
+        self.link_statics(vm_commands)
+        cache = self._cache_of(cache_dir) if self.use_cache and cache_dir is not None else None
+        results = [None] * len(vm_commands)
+        misses = []
+        for i, (file_name, commands) in enumerate(vm_commands):
+            digest = cache.digest(file_name, commands) if cache is not None else None
+            asm_codes = cache.get(file_name, digest) if cache is not None else None
+            if asm_codes is None:
+                misses.append((i, digest))
+            else:
+                results[i] = asm_codes
+
+        tasks = [(self._options(), self.statics) + vm_commands[i] for i, _ in misses]
+        if jobs == 1 or len(tasks) <= 1:
+            translated = [self.translate_commands(commands, file_name) for _, _, file_name, commands in tasks]
+        else:
+            translated = []
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                for asm_codes, removed, folded, fused in executor.map(_translate_commands, tasks):
+                    translated.append(asm_codes)
+                    self.removed += removed
+                    self.folded += folded
+                    self.fused += fused
+        for (i, digest), asm_codes in zip(misses, translated):
+            results[i] = asm_codes
+            if cache is not None:
+                cache.put(vm_commands[i][0], digest, asm_codes)
+        if cache is not None:
+            cache.save()
+
+        self.translated = [vm_commands[i][0] for i, _ in misses]
+        asm_codes = self._boot()
+        for codes in results:
+            asm_codes += codes
+        return asm_codes
+
+    def _optimize(self, asm_codes):
+        if not self.optimize:
+            return asm_codes
+        asm_codes, removed = peephole(asm_codes)
+        self.removed += removed
+        return asm_codes
+
+    def prune_functions(self, vm_files, entry='Sys.init'):
+        # 只保留从 entry 可达的函数，见 VMLinker.prune_functions；被删除的函数名记录在 self.pruned
+        vm_files, self.pruned = VMLinker.prune_functions(vm_files, entry)
+        return vm_files
+
+    def inline_functions(self, vm_commands):
+        # 内联展开代价不超过 self.inline 的叶子函数，见 VMLinker.inline_functions；结果记录在 self.inlined
+        vm_commands, self.inlined = VMLinker.inline_functions(vm_commands, self.inline)
+        return vm_commands
+
+    def inline_report(self):
+        return VMLinker.inline_report(self.inlined)
+
+    def _stubs(self):
+        # 共享例程的调用约定，R13 - R15 为 VM 规范留给翻译器使用的通用寄存器:
+        # $CALL:      D = 返回地址, R13 = nArgs, R14 = 被调函数地址
+        # $RETURN:    直接跳转，返回地址取自栈帧，R13 / R14 暂存 endFrame 与 retAddr
+        # $CMP.<op>:  D = 返回地址，弹出 x, y 并压入 x <op> y 的布尔值，返回地址暂存于 R15
+        # $TAIL:      R13 = nArgs, R14 = 被调函数地址，复用当前栈帧，R15 为搬移时的源指针
+        asm_code = ['($CALL)'] + PATTERN['push_D_in_stack'] + PATTERN['push_frame'] + [
+            '@R13',
+            'D=M',
+            '@5',
+            'D=D+A',
+            '@SP',
+            'D=M-D',
+            '@ARG',
+            'M=D',  # ARG = SP - 5 - nArgs
+            '@SP',
+            'D=M',
+            '@LCL',
+            'M=D',  # LCL = SP
+            '@R14',
+            'A=M',
+            '0;JMP',  # goto function
+        ] + ['($RETURN)'] + PATTERN['return']
+        # 在栈顶参数之后压入当前栈帧保存的 retAddr LCL ARG THIS THAT，再把这 nArgs + 5 个字整体下移到 ARG 处
+        # 目标地址不高于源地址，按升序逐字搬移不会覆盖尚未搬移的数据；ARG 不变，LCL = SP
+        asm_code += [
+            '($TAIL)',
+            '@LCL',
+            'D=M',
+            '@5',
+            'D=D-A',
+            '@R15',
+            'M=D',  # R15 = LCL - 5
+        ]
+        for i in range(5):
+            asm_code += [
+                '@R15',
+                'M=M+1',
+                'A=M-1',
+                'D=M',
+            ] + PATTERN['push_D_in_stack']
+        asm_code += [
+            '@R13',
+            'D=M',
+            '@5',
+            'D=D+A',
+            '@R13',
+            'M=D',  # R13 = nArgs + 5
+            '@SP',
+            'D=M',
+            '@R13',
+            'D=D-M',
+            '@R15',
+            'M=D',  # R15 = SP - nArgs - 5
+            '@ARG',
+            'D=M',
+            '@LCL',
+            'M=D',  # LCL = ARG
+            '($TAIL.move)',
+            '@R15',
+            'AM=M+1',
+            'A=A-1',
+            'D=M',
+            '@LCL',
+            'AM=M+1',
+            'A=A-1',
+            'M=D',  # *LCL++ = *R15++
+            '@R13',
+            'MD=M-1',
+            '@$TAIL.move',
+            'D;JGT',
+            '@LCL',
+            'D=M',
+            '@SP',
+            'M=D',  # SP = LCL = ARG + nArgs + 5
+            '@R14',
+            'A=M',
+            '0;JMP',  # goto function
+        ]
+        for op, jump in BI_JMP.items():
+            asm_code += [
+                f'($CMP.{KEYWORD[op]})',
+                '@R15',
+                'M=D',
+            ] + PATTERN['extract_x_y'] + [
+                'D=M-D',
+                '@$CMP.true',
+                jump,
+                '@$CMP.false',
+                '0;JMP',
+            ]
+        asm_code += [
+            '($CMP.false)',
+            'D=0',
+            '@$CMP.push',
+            '0;JMP',
+            '($CMP.true)',
+            'D=-1',
+            '($CMP.push)',
+        ] + PATTERN['push_D_in_stack'] + [
+            '@R15',
+            'A=M',
+            '0;JMP',
+        ]
+        return asm_code
+
     def _boot(self):
-        return [
+        asm_code = [
             '@256',
             'D=A',
             '@SP',
             'M=D',  # SP = 256
-        ] + self._code_writer('C_CALL', 'Sys.init', 0)
+        ] + self._code_writer(VMCommand(C_CALL, 'Sys.init', 0))
+        if self.shared_stubs:  # Sys.init 不会返回，共享例程放在 boot 之后只会通过跳转进入
+            asm_code += self._stubs()
+        return self._optimize(asm_code)
 
-    def translate(self, vm_path):
+    def translate_project(self, root, jobs=1, verbose=False):
+        '''
+        翻译 root 目录下的 .vm 文件并返回汇编，不写文件，没有 .vm 文件时返回 None
+        只有一个 .vm 文件且不是 Sys.vm 时与 translate_file 相同（没有 boot），否则按文件名连接并链接
+        '''
+        vm_files = sorted(f for f in os.listdir(root) if os.path.splitext(f)[-1] == '.vm')
+        if len(vm_files) == 0:
+            return None
+        if len(vm_files) == 1 and vm_files[0] != 'Sys.vm':
+            return self._with_stubs(self.translate_file(os.path.join(root, vm_files[0]), write_asm_file=False))
+        vm_commands = []
+        for f in vm_files:  # 按文件名连接，输出不依赖 os.walk 的顺序
+            with open(os.path.join(root, f), 'r', encoding='utf8') as fpr:
+                vm_commands.append((os.path.splitext(f)[0], parse_vm(fpr)))
+        if self.inline:
+            vm_commands = self.inline_functions(vm_commands)
+            if verbose:
+                print(f'INLINE {root}: {self.inline_report()}')
+        if self.prune:
+            vm_commands = self.prune_functions(vm_commands)
+            if verbose:
+                print(f'PRUNE {root}: {len(self.pruned)} unreachable functions {self.pruned}')
+        asm_codes = self.translate_files(vm_commands, jobs, root)
+        if verbose:
+            print(f'LINK {root}: {self.static_report()}')
+        return asm_codes
+
+    def translate(self, vm_path, jobs=1):
+        removed, folded, fused = self.removed, self.folded, self.fused
         fname, ext = os.path.splitext(vm_path)
         if ext == '.vm':  # single file
             self.translate_file(vm_path)
@@ -385,14 +1132,24 @@ class VMtranslator:
                 vm_files = [f for f in files if os.path.splitext(f)[-1] == '.vm']
                 if len(vm_files) == 1 and vm_files[0] != 'Sys.vm':
                     self.translate_file(os.path.join(root, vm_files[0]))
-                else:
-                    asm_codes = self._boot()
-                    for f in vm_files:
-                        asm_codes += self.translate_file(os.path.join(root, f), False)
+                elif len(vm_files) > 0:
+                    asm_codes = self.translate_project(root, jobs, verbose=True)
                     head, tail = os.path.split(root)
                     asm_path = os.path.join(root, tail + '.asm')
                     with open(asm_path, 'w', encoding='utf8') as fpw:
                         fpw.writelines([code + '\n' for code in asm_codes])
+        if self.optimize:
+            print(f'OPTIMIZE {vm_path}: folded {self.folded - folded} VM commands, fused {self.fused - fused} commands, '
+                  f'peephole removed {self.removed - removed} instructions!')
+
+
+def _translate_commands(args):
+    # 进程池的工作函数，每个进程各自持有一个 VMtranslator，返回汇编与优化计数供主进程汇总
+    options, statics, file_name, commands = args
+    vm_translator = VMtranslator(**options)
+    vm_translator.statics = statics
+    asm_codes = vm_translator.translate_commands(commands, file_name)
+    return asm_codes, vm_translator.removed, vm_translator.folded, vm_translator.fused
 
 
 if __name__ == '__main__':
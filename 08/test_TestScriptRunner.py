@@ -0,0 +1,25 @@
+import pytest
+
+import TestScriptRunner as runner
+
+CMP = ['|RAM[0]|RAM[1]|', '|   5  |  *   |', '']
+
+
+@pytest.mark.parametrize('out_lines, ok', [
+    (['|RAM[0]|RAM[1]|', '|   5  |  7   |'], True),
+    (['| RAM[0] | RAM[1] |', '|   5  |  7   |', ''], True),
+    (['|RAM[0]|RAM[1]|', '|   6  |  7   |'], False),
+    # 表头比较列名而不只是列数
+    (['|a|b|', '|   5  |  7   |'], False),
+    (['|RAM[0]|', '|   5  |'], False),
+    # 缺少或多出的行都是差异
+    (['|RAM[0]|RAM[1]|'], False),
+    (['|RAM[0]|RAM[1]|', '|   5  |  7   |', '|   5  |  7   |'], False),
+])
+def test_compare_output(out_lines, ok):
+    assert (runner.compare_output(out_lines, CMP) is None) == ok
+
+
+def test_compare_output_header_wildcard():
+    # * 只在数据行中是通配符
+    assert runner.compare_output(['|a|b|'], ['|RAM[0]|*|']) is not None
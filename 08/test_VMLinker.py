@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+from VMLinker import inline_functions
+from VMtranslator import VMtranslator, parse_vm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '06'))
+from assembler import Assembler  # noqa: E402
+from emulator import CPUEmulator  # noqa: E402
+
+SYS_INIT = '''
+function Sys.init 0
+push constant 7
+push constant 5
+call Sys.f 2
+pop static 0
+label END
+goto END
+'''
+
+
+def _run(vm_code, inline):
+    vm_translator = VMtranslator(inline=inline)
+    vm_commands = vm_translator.inline_functions([('Sys', parse_vm(vm_code.splitlines()))])
+    hack, _ = Assembler().assemble(vm_translator.translate_files(vm_commands))
+    cpu = CPUEmulator()
+    cpu.load(hack)
+    cpu.run(10000)
+    return cpu.ram[0], cpu.ram[vm_translator.statics['Sys.0']]
+
+
+@pytest.mark.parametrize('body, inlined', [
+    (['push argument 0', 'push argument 1', 'sub', 'neg'], True),
+    (['push argument 0', 'pop temp 1', 'push argument 1'], True),
+    # return 只取栈顶，多余的值随栈帧丢弃
+    (['push argument 0', 'push constant 1', 'push constant 2'], False),
+    (['push argument 0', 'push argument 1', 'push constant 1', 'add'], False),
+    # 取到函数自己的空栈以下
+    (['pop temp 1', 'push constant 1'], False),
+    (['add'], False),
+    (['push constant 1', 'pop temp 1', 'not'], False),
+])
+def test_inline_only_balanced_leaves(body, inlined):
+    vm_code = SYS_INIT + '\n'.join(['function Sys.f 0'] + body + ['return'])
+    _, inlined_calls = inline_functions([('Sys', parse_vm(vm_code.splitlines()))], 20)
+    assert ('Sys.f' in inlined_calls) == inlined
+    if body[0].startswith('push'):  # 不会在空栈上取值的函数体，内联与否 SP 与结果都应一致
+        assert _run(vm_code, 20) == _run(vm_code, 0)
+        assert _run(vm_code, 0)[0] == 261
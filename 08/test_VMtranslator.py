@@ -0,0 +1,78 @@
+import itertools
+import os
+import shutil
+
+import pytest
+
+import TestScriptRunner as runner
+import VMtranslator as vm_translator_module
+from VMtranslator import VMtranslator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# 只运行 CPU 测试，VME 测试不经过翻译器
+CPU_TESTS = [path for path in runner.discover(os.path.join(HERE, '..', '07'), HERE) if not path.endswith('VME.tst')]
+OPTION_NAMES = ('optimize', 'shared_stubs', 'prune', 'cache_tos', 'fixed_sp', 'inline')
+OPTION_SETS = [
+    dict(zip(OPTION_NAMES, flags[:-1] + (20 * flags[-1],)))
+    for flags in itertools.product((False, True), repeat=len(OPTION_NAMES))
+]
+
+
+def _failures(vm_options):
+    results = runner.TestScriptRunner(vm_options=vm_options).run_all(CPU_TESTS, jobs=1)
+    assert sum(status == 'PASS' for _, status, _ in results) >= 10
+    return [(os.path.basename(path), status, message) for path, status, message in results
+            if status not in ('PASS', 'SKIP')]
+
+
+@pytest.mark.parametrize('vm_options', OPTION_SETS, ids=lambda options: ','.join(
+    f'{name}={int(val)}' for name, val in options.items()))
+def test_translator_options(vm_options):
+    assert _failures(vm_options) == []
+
+
+def test_discard_temp():
+    # discard_temp 假定 temp 0 只是 JackCompiler 的中转，只在 optimize 时由 fuse_calls 生效；
+    # NestedCall 的 .cmp 检查 do 语句之后的 temp 0，因此它是唯一应当不一致的测试
+    assert _failures({'discard_temp': True}) == []
+    failures = _failures({'optimize': True, 'discard_temp': True})
+    assert [(name, status) for name, status, _ in failures] == [('NestedCall.tst', 'FAIL')]
+
+
+def _rebuild(project, **options):
+    vm_translator = VMtranslator(use_cache=True, **options)
+    asm_codes = vm_translator.translate_project(project)
+    return asm_codes, sorted(vm_translator.translated)
+
+
+def _edit(path, old, new):
+    with open(path, 'r', encoding='utf8') as fpr:
+        vm_code = fpr.read()
+    assert old in vm_code
+    with open(path, 'w', encoding='utf8') as fpw:
+        fpw.write(vm_code.replace(old, new))
+
+
+def test_translation_cache(tmp_path, monkeypatch):
+    project = str(tmp_path / 'StaticsTest')
+    shutil.copytree(os.path.join(HERE, 'FunctionCalls', 'StaticsTest'), project)
+    asm_codes, translated = _rebuild(project)
+    assert translated == ['Class1', 'Class2', 'Sys']
+    # 没有任何改动时全部命中，输出与重新翻译一致
+    assert _rebuild(project) == (asm_codes, [])
+    # 只改注释不改变命令
+    _edit(os.path.join(project, 'Class2.vm'), '\nsub\n', '\nsub  // x - y\n')
+    assert _rebuild(project) == (asm_codes, [])
+    # 只有被修改的文件重新翻译
+    _edit(os.path.join(project, 'Class2.vm'), '\nsub', '\nadd')
+    asm_codes, translated = _rebuild(project)
+    assert translated == ['Class2']
+    assert asm_codes == VMtranslator().translate_project(project)
+    # Class1 多出一个 static 后，排在它后面的 Class2 的 static 地址改变，也要重新翻译
+    _edit(os.path.join(project, 'Class1.vm'), 'pop static 1', 'pop static 2')
+    assert _rebuild(project)[1] == ['Class1', 'Class2']
+    # 翻译选项或翻译器版本改变时全部重新翻译
+    assert _rebuild(project, optimize=True)[1] == ['Class1', 'Class2', 'Sys']
+    assert _rebuild(project, optimize=True)[1] == []
+    monkeypatch.setattr(vm_translator_module, 'TRANSLATOR_VERSION', 'edited')
+    assert _rebuild(project, optimize=True)[1] == ['Class1', 'Class2', 'Sys']
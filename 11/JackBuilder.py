@@ -0,0 +1,93 @@
+import os
+import sys
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(_ROOT, '06'))
+sys.path.append(os.path.join(_ROOT, '08'))
+from assembler import Assembler  # noqa: E402
+from VMtranslator import VMtranslator, parse_vm  # noqa: E402
+from JackCompiler import JackCompiler  # noqa: E402
+
+OS_DIR = os.path.join(_ROOT, '12')
+
+
+class JackBuilder:
+    '''
+    Jack -> VM -> ASM -> Hack 的一体化构建，各阶段之间直接传递内存中的命令列表:
+    VMWriter.vm -> parse_vm -> VMtranslator.translate_commands -> Assembler.assemble
+    中间文件只在 write_vm / write_asm 时写出
+    '''
+    def __init__(self, use_cache=False, optimize=False, shared_stubs=False, prune=False, cache_tos=False, fixed_sp=False,
+                 inline=0):
+        self.jack_compiler = JackCompiler(use_cache)
+        # JackCompiler 只把 temp 0 用作中转，do 语句丢弃的返回值不必写入 temp 0
+        self.vm_translator = VMtranslator(optimize, shared_stubs, prune, cache_tos, fixed_sp, use_cache, discard_temp=True,
+                                          inline=inline)
+        self.assembler = Assembler()
+
+    def _jack_files(self, jack_dir, os_dir):
+        # 项目内的类优先，os_dir 只补充项目中没有的 OS 类；按类名排序保证输出稳定
+        jack_files = {}
+        for root in [os_dir, jack_dir] if os_dir is not None else [jack_dir]:
+            for f in os.listdir(root):
+                class_name, ext = os.path.splitext(f)
+                if ext == '.jack':
+                    jack_files[class_name] = os.path.join(root, f)
+        return [(class_name, jack_files[class_name]) for class_name in sorted(jack_files)]
+
+    def compile_vm(self, jack_dir, os_dir=None, write_vm=False, jobs=1):
+        '''
+        返回 [(class_name, vm_codes), ...]，jobs 含义同 JackCompiler.compile_jack_files
+        '''
+        jack_files = self._jack_files(jack_dir, os_dir)
+        vm_files = list(zip(
+            [class_name for class_name, _ in jack_files],
+            self.jack_compiler.compile_jack_files([jack_path for _, jack_path in jack_files], False, jobs),
+        ))
+        if write_vm:
+            for class_name, vm_codes in vm_files:
+                with open(os.path.join(jack_dir, class_name + '.vm'), 'w', encoding='utf8') as fpw:
+                    fpw.writelines([code + '\n' for code in vm_codes])
+        return vm_files
+
+    def translate_asm(self, vm_files, jobs=1, cache_dir=None):
+        # jobs、cache_dir 含义同 VMtranslator.translate_files
+        vm_commands = [(class_name, parse_vm(vm_codes)) for class_name, vm_codes in vm_files]
+        vm_commands = self.vm_translator.inline_functions(vm_commands)
+        if self.vm_translator.prune:
+            vm_commands = self.vm_translator.prune_functions(vm_commands)
+        return self.vm_translator.translate_files(vm_commands, jobs, cache_dir)
+
+    def build(self, jack_dir, os_dir=None, write_vm=False, write_asm=False, write_hack=True, jobs=1):
+        '''
+        构建 jack_dir 目录下的整个程序，返回 Assembler.assemble 得到的 array('H')
+        输出文件与 VMtranslator.translate 的目录模式一致，命名为 <目录名>.asm / <目录名>.hack
+        '''
+        vm_files = self.compile_vm(jack_dir, os_dir, write_vm, jobs)
+        asm_codes = self.translate_asm(vm_files, jobs, jack_dir)
+        hack, _ = self.assembler.assemble(asm_codes)
+
+        program_name = os.path.basename(os.path.normpath(jack_dir))
+        if write_asm:
+            with open(os.path.join(jack_dir, program_name + '.asm'), 'w', encoding='utf8') as fpw:
+                fpw.writelines([code + '\n' for code in asm_codes])
+        if write_hack:
+            self.assembler.hack_path = os.path.join(jack_dir, program_name + '.hack')
+            self.assembler.save_hack()
+        return hack
+
+
+if __name__ == '__main__':
+    import time
+
+    jack_builder = JackBuilder(optimize=True, shared_stubs=True, prune=True, inline=12)
+    for jack_dir in ['./Seven', './ConvertToBin', './Square', './Average', './Pong', './ComplexArrays']:
+        start = time.perf_counter()
+        try:
+            hack = jack_builder.build(jack_dir, OS_DIR, write_hack=False)
+            print(f'BUILD {jack_dir}: {len(hack)} instructions in {time.perf_counter() - start:.2f}s, '
+                  f'pruned {len(jack_builder.vm_translator.pruned)} unreachable functions, '
+                  f'{jack_builder.vm_translator.static_report()}, '
+                  f'inlined {jack_builder.vm_translator.inline_report()}')
+        except AssertionError as e:  # 完整 OS 未经优化时超出 32K ROM
+            print(f'BUILD {jack_dir}: {e} after {time.perf_counter() - start:.2f}s')
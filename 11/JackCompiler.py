@@ -1,5 +1,17 @@
+import hashlib
 import os
 import re
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '08'))
+from BuildCache import BuildCache, source_digest  # noqa: E402
+
+# type 取值与 T.xml 的标签一致: keyword | symbol | integerConstant | stringConstant | identifier
+Token = namedtuple('Token', ['type', 'val', 'line'])
+CACHE_NAME = '.jackcache.json'
+COMPILER_VERSION = source_digest(__file__)  # 编译器源码的哈希作为版本号，修改编译器后旧缓存自动失效
 
 
 class SymbolTable:
@@ -59,6 +71,7 @@ class VMWriter:
     def __init__(self, vm_path):
         self.vm = []
         self.vm_path = vm_path
+        self.calls = {}  # 被调用的函数名，按首次出现顺序，dict 用作有序集合
         self.arithmetic_mapping = {
             '+': 'add',
             '-': {False: 'neg', True: 'sub'},
@@ -90,7 +103,11 @@ class VMWriter:
             vm_code = self.arithmetic_mapping[command][sub_flag]
         else:
             vm_code = self.arithmetic_mapping[command]
-        self._write(vm_code)
+        if vm_code.startswith('call'):  # * 和 / 由 OS 的 Math 类实现
+            _, name, n_args = vm_code.split()
+            self.write_call(name, n_args)
+        else:
+            self._write(vm_code)
 
     def write_label(self, label):
         self._write(f'label {label}')
@@ -102,6 +119,7 @@ class VMWriter:
         self._write(f'if-goto {label}')
 
     def write_call(self, name, n_args):
+        self.calls[name] = None
         self._write(f'call {name} {n_args}')
 
     def write_function(self, name, n_locals):
@@ -118,90 +136,59 @@ class VMWriter:
     def reset(self):
         self.vm = []
         self.vm_path = None
+        self.calls = {}
 
 
 class JackTokenizer:
     def __init__(self, debug=False):
-        self.keyword = [
+        self.keyword = {
             'class', 'constructor', 'function', 'method',
             'field', 'static', 'var', 'int', 'char', 'boolean',
             'void', 'true', 'false', 'null', 'this', 'let', 'do',
             'if', 'else', 'while', 'return',
-        ]
+        }
         self.symbol = [
             '{', '}', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*',
             '/', '&', '|', '<', '>', '=', '~',
         ]
-        self._in_block_comments = False
-
-    def _reset_state(self):
-        self._in_block_comments = False
-
-    def _ignore_white_space(self, jack_code):
-        '''
-        处理 line comments 与 block comments 并提供简单的检查
-        '''
-        jack_code = jack_code.strip()
-        if self._in_block_comments:
-            assert jack_code.startswith('*')
-            self._in_block_comments = not (jack_code.startswith('*/') or jack_code.endswith('*/'))
-            jack_code = ''
-        else:
-            if jack_code.startswith('/**'):
-                # block comment can be used as line comment
-                self._in_block_comments = not jack_code.endswith('*/')
-                jack_code = ''
-            jack_code = jack_code.split('//')[0].strip()  # no line comment
-        # print(jack_code)
-        return jack_code
-
-    def _mark_up_token(self, jack_xml, token_val, token_type):
-        jack_xml.append(
-            f"<{token_type}> {token_val} </{token_type}>"
-        )
-
-    def tokenizing_line(self, jack_code):
-        jack_code = self._ignore_white_space(jack_code)
-        # 所有标准符号加上空格作为切分符号
-        symbols_reg = '([' + ''.join(['\\' + s for s in self.symbol]) + '\s])'
-        tokens = re.split(symbols_reg, jack_code)
-        tokens = [token for token in tokens if len(token) > 0]
-        # print(symbols_reg)
-        # print(tokens)
-        jack_xml = []
-        _in_string = False
-        _string_token = ''
-        for token in tokens:
-            if _in_string:
-                _string_token += token
-                _in_string = not token.endswith('"')
-                if not _in_string:
-                    self._mark_up_token(jack_xml, _string_token[1:-1], 'stringConstant')
+        # 整个文件只用一个正则扫描一遍，注释可以出现在行内任意位置
+        self.token_reg = re.compile('|'.join([
+            r'(?P<comment>//[^\n]*|/\*.*?\*/)',
+            r'(?P<stringConstant>"[^"\n]*")',
+            r'(?P<integerConstant>\d+)',
+            r'(?P<identifier>[A-Za-z_]\w*)',
+            '(?P<symbol>[' + ''.join(['\\' + s for s in self.symbol]) + '])',
+            r'(?P<newline>\n)',
+            r'(?P<space>[^\S\n]+)',
+            r'(?P<error>.)',
+        ]), re.S)
+
+    def tokenizing_code(self, jack_code):
+        jack_tokens = []
+        line_no = 1
+        keyword = self.keyword
+        for match in self.token_reg.finditer(jack_code):
+            token_type = match.lastgroup
+            if token_type == 'space':
+                continue
+            elif token_type == 'newline':
+                line_no += 1
+            elif token_type == 'comment':
+                line_no += match.group().count('\n')
+            elif token_type == 'identifier':
+                token = match.group()
+                jack_tokens.append(Token('keyword' if token in keyword else 'identifier', token, line_no))
+            elif token_type == 'stringConstant':
+                jack_tokens.append(Token(token_type, match.group()[1:-1], line_no))
+            elif token_type == 'error':
+                assert False, f'Tokenizing Error: line {line_no}, unexpected {match.group()}'
             else:
-                if token == ' ':  # 空格如果是 stringConstant 内部内容则需要保留
-                    continue
-                if token in self.keyword:
-                    self._mark_up_token(jack_xml, token, 'keyword')
-                elif token in self.symbol:
-                    self._mark_up_token(jack_xml, token, 'symbol')
-                elif re.match(r'\d', token):
-                    self._mark_up_token(jack_xml, token, 'integerConstant')
-                elif token.startswith('"'):
-                    _string_token += token
-                    _in_string = not token.endswith('"')
-                    if not _in_string:
-                        self._mark_up_token(jack_xml, token[1:-1], 'stringConstant')
-                else:
-                    self._mark_up_token(jack_xml, token, 'identifier')
-        return jack_xml
+                jack_tokens.append(Token(token_type, match.group(), line_no))
+        return jack_tokens
 
     def tokenizing(self, jack_path):
-        xmlT_codes = []
         with open(jack_path, 'r', encoding='utf8') as fpr:
-            for jack_code in fpr:
-                xmlT_codes += self.tokenizing_line(jack_code)
-        self._reset_state()
-        return xmlT_codes
+            return self.tokenizing_code(fpr.read())
 
 
 class CompilationEngine:
@@ -212,6 +199,7 @@ class CompilationEngine:
         self._reset()
 
     def _reset(self):
+        self.calls = []
         self.class_name = None
         self.symbol_table = None
         self.idx = 0
@@ -228,21 +216,17 @@ class CompilationEngine:
     def _get_token(self, offset=0):
         return self.tokens[self.idx + offset]
 
-    def _extract_token(self, offset=0):
-        token = self._get_token(offset)
-        token_type = re.search(r'</(.+)>', token).group(1)
-        token_val = re.search(r'> (.+) <', token).group(1)
-        return token_type, token_val
-
     def _check_token(self, offset, rule_val=None, rule_type=None):
-        token_type, token_val = self._extract_token(offset)
+        token_type, token_val, _ = self._get_token(offset)
 
         if isinstance(rule_type, tuple):
             check_type = token_type in rule_type
         else:
             check_type = token_type == rule_type
 
-        if isinstance(rule_val, tuple):
+        if token_type == 'stringConstant':  # 字符串内容不能被当作关键字或符号，例如 ")"
+            check_val = False
+        elif isinstance(rule_val, tuple):
             check_val = token_val in rule_val
         else:
             check_val = token_val == rule_val
@@ -258,7 +242,7 @@ class CompilationEngine:
     def _confirm(self, rule_val=None, rule_type=None):
         # check_token & read continue
         check, token_type, token_val = self._check_token(0, rule_val, rule_type)
-        assert check, 'Compilation Error'
+        assert check, f'Compilation Error: line {self._get_token().line}, unexpected {token_val}'
         self.idx += 1
         return token_type, token_val
 
@@ -535,37 +519,110 @@ class CompilationEngine:
                 n_args += 1
         return n_args
 
-    def parser(self, tokens, vm_path):
+    def parser(self, tokens, vm_path, write_vm_file=True):
         self.tokens = tokens
         self.symbol_table = SymbolTable()
         self.vm_writer = VMWriter(vm_path)
         self._compile_class()
-        self.vm_writer.write_file()
+        if write_vm_file:
+            self.vm_writer.write_file()
+        vm_codes = self.vm_writer.vm
+        calls = list(self.vm_writer.calls)
         # print(self.symbol_table.class_symbol_table)
         self._reset()
+        self.calls = calls  # 本类 write_call 的目标函数，即类之间的调用图中从本类出发的边
+        return vm_codes
+
+
+def _source_key(file_name, jack_code):
+    # 每个类只依赖自身的源码，缓存以源码的 sha1 为键
+    return hashlib.sha1(jack_code.encode('utf8')).hexdigest()
+
+
+def _compile_jack_file(args):
+    # 进程池的工作函数，每个进程各自持有一个 JackCompiler；类之间只共享 .jack 源码，没有其他状态
+    jack_path, jack_code, write_vm_file = args
+    return JackCompiler()._compile_code(jack_path, jack_code, write_vm_file)
 
 
 class JackCompiler:
-    def __init__(self):
+    def __init__(self, use_cache=False):
         self.jack_tokenizer = JackTokenizer()
         self.compilation_engine = CompilationEngine()
-
-    def compile_jack_file(self, jack_path):
+        self.use_cache = use_cache
+        self.caches = {}  # 目录 -> BuildCache
+        # 类名 -> 该类调用的函数名，跨多次编译累积；下游的重新翻译范围不由它推算，
+        # VMtranslator 的缓存按内联、剪枝之后的命令求哈希，只有实际内联了被修改函数的调用者才会重新翻译
+        self.calls = {}
+        self.compiled = []  # 最近一次编译中缓存未命中、真正重新编译的 .jack 文件
+
+    def _compile_code(self, jack_path, jack_code, write_vm_file=True):
         head, tail = os.path.split(jack_path)
         fname, ext = os.path.splitext(tail)
-        tokens = self.jack_tokenizer.tokenizing(jack_path)
+        tokens = self.jack_tokenizer.tokenizing_code(jack_code)
         vm_path = os.path.join(head, fname + '.vm')
-        self.compilation_engine.parser(tokens, vm_path)
+        vm_codes = self.compilation_engine.parser(tokens, vm_path, write_vm_file)
+        return vm_codes, self.compilation_engine.calls
 
-    def compile_jack(self, jack_path):
+    def _cache_of(self, jack_path):
+        cache_dir = os.path.dirname(os.path.abspath(jack_path))
+        if cache_dir not in self.caches:
+            self.caches[cache_dir] = BuildCache(os.path.join(cache_dir, CACHE_NAME), COMPILER_VERSION, _source_key)
+        return self.caches[cache_dir]
+
+    def compile_jack_file(self, jack_path, write_vm_file=True):
+        return self.compile_jack_files([jack_path], write_vm_file)[0]
+
+    def compile_jack_files(self, jack_paths, write_vm_file=True, jobs=1):
+        '''
+        编译多个相互独立的类，返回与 jack_paths 顺序一致的 vm 命令列表
+        jobs 为进程数，None 表示使用全部 CPU，1 表示在当前进程内顺序编译
+        use_cache 时源码哈希未变的类直接取缓存，只有未命中的类才会分发给进程池
+        '''
+        results = [None] * len(jack_paths)
+        misses = []
+        for i, jack_path in enumerate(jack_paths):
+            with open(jack_path, 'r', encoding='utf8') as fpr:
+                jack_code = fpr.read()
+            cache = self._cache_of(jack_path) if self.use_cache else None
+            digest = cache.digest(os.path.basename(jack_path), jack_code) if cache is not None else None
+            entry = cache.get(os.path.basename(jack_path), digest) if cache is not None else None
+            if entry is None:
+                misses.append((i, jack_code, digest))
+                continue
+            results[i] = entry
+            if write_vm_file:
+                vm_writer = VMWriter(os.path.splitext(jack_path)[0] + '.vm')
+                vm_writer.vm = entry[0]
+                vm_writer.write_file()
+
+        tasks = [(jack_paths[i], jack_code, write_vm_file) for i, jack_code, _ in misses]
+        if jobs == 1 or len(tasks) <= 1:
+            compiled = [self._compile_code(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                compiled = list(executor.map(_compile_jack_file, tasks))
+        for (i, _, digest), (vm_codes, calls) in zip(misses, compiled):
+            results[i] = vm_codes, calls
+            if self.use_cache:
+                self._cache_of(jack_paths[i]).put(os.path.basename(jack_paths[i]), digest, [vm_codes, calls])
+        for cache in self.caches.values():
+            cache.save()
+
+        self.compiled = [jack_paths[i] for i, _, _ in misses]
+        for jack_path, (vm_codes, calls) in zip(jack_paths, results):
+            self.calls[os.path.splitext(os.path.basename(jack_path))[0]] = calls
+        return [vm_codes for vm_codes, _ in results]
+
+    def compile_jack(self, jack_path, jobs=1):
         fname, ext = os.path.splitext(jack_path)
         if ext == '.jack':  # single file
             self.compile_jack_file(jack_path)
         else:  # project directory
+            jack_paths = []
             for root, _, files in os.walk(jack_path):
-                for f in files:
-                    if os.path.splitext(f)[-1] == '.jack':
-                        self.compile_jack_file(os.path.join(root, f))
+                jack_paths += [os.path.join(root, f) for f in files if os.path.splitext(f)[-1] == '.jack']
+            self.compile_jack_files(sorted(jack_paths), jobs=jobs)
 
 
 if __name__ == '__main__':
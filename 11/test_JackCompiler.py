@@ -0,0 +1,52 @@
+import os
+import shutil
+
+import JackCompiler as jack_compiler_module
+from JackCompiler import JackCompiler, JackTokenizer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _tokens(jack_code):
+    return [(token.type, token.val) for token in JackTokenizer().tokenizing_code(jack_code)]
+
+
+def test_mid_line_comments():
+    plain = 'let x = a / b; do Output.printString("a // b /* c */");\nreturn x;\n'
+    commented = ('let x = a /* 行内 */ / b; // 行尾注释\n'
+                 'do Output.printString("a // b /* c */"); /* 跨行\n注释 */ return x; // x\n')
+    assert _tokens(commented) == _tokens(plain)
+    # 跨行注释之后的行号仍然正确
+    assert JackTokenizer().tokenizing_code(commented)[-2].line == 3
+
+
+def _compile(project, **kwargs):
+    jack_compiler = JackCompiler(use_cache=True)
+    jack_paths = sorted(os.path.join(project, f) for f in os.listdir(project) if f.endswith('.jack'))
+    vm_files = jack_compiler.compile_jack_files(jack_paths, write_vm_file=False, **kwargs)
+    return vm_files, [os.path.basename(path) for path in jack_compiler.compiled]
+
+
+def test_compile_cache(tmp_path, monkeypatch):
+    project = str(tmp_path / 'Square')
+    shutil.copytree(os.path.join(HERE, 'Square'), project, ignore=shutil.ignore_patterns('*.vm', '.*'))
+    vm_files, compiled = _compile(project)
+    assert compiled == ['Main.jack', 'Square.jack', 'SquareGame.jack']
+    # 源码不变时全部命中，结果与重新编译一致
+    assert _compile(project) == (vm_files, [])
+    # 只有被修改的类重新编译
+    with open(os.path.join(project, 'Square.jack'), 'a', encoding='utf8') as fpw:
+        fpw.write('// edited\n')
+    assert _compile(project) == (vm_files, ['Square.jack'])
+    # 进程池同样只分发未命中的类
+    for name in ['Main.jack', 'SquareGame.jack']:
+        with open(os.path.join(project, name), 'a', encoding='utf8') as fpw:
+            fpw.write('// edited\n')
+    assert _compile(project, jobs=2) == (vm_files, ['Main.jack', 'SquareGame.jack'])
+    # 缓存损坏或编译器版本改变时从头编译
+    with open(os.path.join(project, jack_compiler_module.CACHE_NAME), 'w', encoding='utf8') as fpw:
+        fpw.write('{')
+    assert _compile(project)[1] == ['Main.jack', 'Square.jack', 'SquareGame.jack']
+    monkeypatch.setattr(jack_compiler_module, 'COMPILER_VERSION', 'edited')
+    assert _compile(project)[1] == ['Main.jack', 'Square.jack', 'SquareGame.jack']
+    assert _compile(project)[1] == []